@@ -2,27 +2,48 @@ from __future__ import unicode_literals
 
 from conllu.compat import string_to_file
 from conllu.models import TokenList
-from conllu.parser import parse_conllu_plus_fields, parse_sentences, parse_token_and_metadata
+from conllu.parallel import parse_parallel
+from conllu.parser import (
+    DEFAULT_FIELDS, parse_conllu_plus_fields, parse_sentences, parse_token_and_metadata,
+    resolve_field_parsers,
+)
 
 
-def parse(data, fields=None, field_parsers=None, metadata_parsers=None):
+def parse(data, fields=None, field_parsers=None, metadata_parsers=None,
+          fields_to_parse=None, lazy=False):
     return list(parse_incr(
         string_to_file(data),
         fields=fields,
         field_parsers=field_parsers,
-        metadata_parsers=metadata_parsers
+        metadata_parsers=metadata_parsers,
+        fields_to_parse=fields_to_parse,
+        lazy=lazy
     ))
 
-def parse_incr(in_file, fields=None, field_parsers=None, metadata_parsers=None):
+def parse_incr(in_file, fields=None, field_parsers=None, metadata_parsers=None,
+               fields_to_parse=None, lazy=False):
+    """
+        Parse the sentences from the given file one by one.
+
+        Use `fields_to_parse` (e.g. `("form", "upostag", "head")`) to only keep the given
+        columns of each token; the other columns are not parsed at all.  With `lazy=True`,
+        the values of the kept columns are only parsed (e.g. `feats` into a dictionary) when
+        they are accessed for the first time.
+    """
     if not fields:
         fields = parse_conllu_plus_fields(in_file, metadata_parsers=metadata_parsers)
 
+    # Determine the field parsers once, rather than for each sentence
+    field_parsers = resolve_field_parsers(fields or DEFAULT_FIELDS, field_parsers)
+
     for sentence in parse_sentences(in_file):
         yield TokenList(*parse_token_and_metadata(
             sentence,
             fields=fields,
             field_parsers=field_parsers,
-            metadata_parsers=metadata_parsers
+            metadata_parsers=metadata_parsers,
+            fields_to_parse=fields_to_parse,
+            lazy=lazy
         ))
 
 def parse_tree(data):
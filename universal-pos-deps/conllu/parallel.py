@@ -0,0 +1,119 @@
+from __future__ import unicode_literals
+
+import io
+import os
+import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from conllu.models import TokenList
+from conllu.parser import (
+    DEFAULT_FIELDS, parse_conllu_plus_fields, parse_sentences, parse_token_and_metadata,
+)
+
+DEFAULT_CHUNK_SIZE = 2 ** 24
+BLANK_LINE = re.compile(b"\n\r?\n")
+
+
+def find_boundary(in_file, pos, size, block_size=2 ** 16):
+    """
+        Find the position right after the first blank line which ends after `pos` in the given
+        (binary) file.  The size of the file is returned if there is no such blank line.
+    """
+    if pos >= size:
+        return size
+
+    # Start one byte earlier, in case `pos` points inside a blank line
+    base = pos - 1
+    in_file.seek(base)
+    buf = b""
+    while True:
+        block = in_file.read(block_size)
+        if not block:
+            return size
+
+        buf += block
+        match = BLANK_LINE.search(buf)
+        if match:
+            return base + match.end()
+
+        # Keep the end of the buffer, which can be a part of a blank line
+        keep = min(2, len(buf))
+        base += len(buf) - keep
+        buf = buf[len(buf) - keep:]
+
+def split_file(file_path, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+        Split the given file into byte ranges of (roughly) `chunk_size` bytes, so that each
+        range consists of complete sentences.
+    """
+    size = os.path.getsize(file_path)
+    chunks = []
+    with open(file_path, "rb") as in_file:
+        start = 0
+        while start < size:
+            end = find_boundary(in_file, start + chunk_size, size)
+            chunks.append((start, end))
+            start = end
+
+    return chunks
+
+def read_chunk(file_path, start, end):
+    """
+        Read the given byte range of the file as a text stream.
+    """
+    with open(file_path, "rb") as in_file:
+        in_file.seek(start)
+        data = in_file.read(end - start).decode("utf-8")
+
+    # `newline=None` translates line endings, as when reading the file in text mode
+    return io.StringIO(data, newline=None)
+
+def map_chunks(func, file_path, args=(), chunk_size=DEFAULT_CHUNK_SIZE, workers=None):
+    """
+        Apply `func(file_path, start, end, *args)` to the chunks of the given file (see
+        `split_file`) in a pool of `workers` processes and yield the results in the order of
+        the chunks.  Both `func` and `args` must be picklable.
+    """
+    workers = workers or os.cpu_count() or 1
+    # Limit the number of chunks being processed at the same time, so that the results
+    # do not pile up in memory if they are consumed slowly
+    max_pending = 2 * workers
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for start, end in split_file(file_path, chunk_size):
+            pending.append(executor.submit(func, file_path, start, end, *args))
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+
+def parse_chunk(file_path, start, end, fields, field_parsers, metadata_parsers, fields_to_parse):
+    return [
+        TokenList(*parse_token_and_metadata(
+            sentence,
+            fields=fields,
+            field_parsers=field_parsers,
+            metadata_parsers=metadata_parsers,
+            fields_to_parse=fields_to_parse
+        ))
+        for sentence in parse_sentences(read_chunk(file_path, start, end))
+    ]
+
+def parse_parallel(file_path, workers=None, chunk_size=DEFAULT_CHUNK_SIZE, fields=None,
+                   field_parsers=None, metadata_parsers=None, fields_to_parse=None):
+    """
+        Parse the sentences of the given file in parallel, in a pool of `workers` processes,
+        and yield them in the original order.  The file is split into chunks of (roughly)
+        `chunk_size` bytes at blank-line boundaries.  Custom field and metadata parsers, if
+        any, must be picklable (e.g., module-level functions rather than lambdas).
+    """
+    if not fields:
+        with io.open(file_path, "r", encoding="utf-8") as in_file:
+            fields = parse_conllu_plus_fields(in_file, metadata_parsers=metadata_parsers)
+
+    args = (fields or DEFAULT_FIELDS, field_parsers, metadata_parsers, fields_to_parse)
+    for tokenlists in map_chunks(parse_chunk, file_path, args, chunk_size, workers):
+        for tokenlist in tokenlists:
+            yield tokenlist
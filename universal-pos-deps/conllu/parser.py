@@ -56,18 +56,26 @@ def parse_sentences(in_file):
     if buf:
         yield "".join(buf).rstrip()
 
-def parse_token_and_metadata(data, fields=None, field_parsers=None, metadata_parsers=None):
+def resolve_field_parsers(fields, field_parsers=None):
+    if not field_parsers:
+        return DEFAULT_FIELD_PARSERS
+
+    # Merging would not change anything if all the default parsers are overridden
+    if sorted(field_parsers.keys()) == sorted(fields) or \
+            all(field in field_parsers for field in DEFAULT_FIELD_PARSERS):
+        return field_parsers
+
+    new_field_parsers = DEFAULT_FIELD_PARSERS.copy()
+    new_field_parsers.update(field_parsers)
+    return new_field_parsers
+
+def parse_token_and_metadata(data, fields=None, field_parsers=None, metadata_parsers=None,
+                             fields_to_parse=None, lazy=False):
     if not data:
         raise ParseException("Can't create TokenList, no data sent to constructor.")
 
     fields = fields or DEFAULT_FIELDS
-
-    if not field_parsers:
-        field_parsers = DEFAULT_FIELD_PARSERS.copy()
-    elif sorted(field_parsers.keys()) != sorted(fields):
-        new_field_parsers = DEFAULT_FIELD_PARSERS.copy()
-        new_field_parsers.update(field_parsers)
-        field_parsers = new_field_parsers
+    field_parsers = resolve_field_parsers(fields, field_parsers)
 
     tokens = []
     metadata = OrderedDict()
@@ -83,11 +91,13 @@ def parse_token_and_metadata(data, fields=None, field_parsers=None, metadata_par
             for key, value in pairs:
                 metadata[key] = value
         else:
-            tokens.append(parse_line(line, fields, field_parsers))
+            tokens.append(parse_line(
+                line, fields, field_parsers, fields_to_parse=fields_to_parse, lazy=lazy
+            ))
 
     return tokens, metadata
 
-def parse_line(line, fields, field_parsers=None):
+def parse_line(line, fields, field_parsers=None, fields_to_parse=None, lazy=False):
     # Be backwards compatible if people called parse_line without field_parsers before
     field_parsers = field_parsers or DEFAULT_FIELD_PARSERS
 
@@ -96,14 +106,22 @@ def parse_line(line, fields, field_parsers=None):
     if len(line) == 1:
         raise ParseException("Invalid line format, line must contain either tabs or two spaces.")
 
-    data = OrderedDict()
+    data = LazyToken() if lazy else OrderedDict()
 
     for i, field in enumerate(fields):
         # Allow parsing CoNNL-U files with fewer columns
         if i >= len(line):
             break
 
+        # Only keep the requested columns
+        if fields_to_parse is not None and field not in fields_to_parse:
+            continue
+
         if field in field_parsers:
+            if lazy:
+                data.set_unparsed(text(field), line, i, field_parsers[field])
+                continue
+
             try:
                 value = field_parsers[field](line, i)
             except ParseException as e:
@@ -116,6 +134,87 @@ def parse_line(line, fields, field_parsers=None):
 
     return data
 
+class LazyToken(OrderedDict):
+    """
+        Token whose field values are only parsed (with the corresponding field parsers)
+        when they are accessed.  Until then, the raw values are stored.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._line = None
+        self._unparsed = {}
+        super(LazyToken, self).__init__(*args, **kwargs)
+
+    def set_unparsed(self, field, line, i, field_parser):
+        self._line = line
+        self._unparsed[field] = (field_parser, i)
+        OrderedDict.__setitem__(self, field, line[i])
+
+    def _parse(self, field):
+        field_parser, i = self._unparsed.pop(field)
+        try:
+            value = field_parser(self._line, i)
+        except ParseException as e:
+            raise ParseException("Failed parsing field '{}': ".format(field) + str(e))
+        OrderedDict.__setitem__(self, field, value)
+
+    def parse_all(self):
+        for field in list(self._unparsed):
+            self._parse(field)
+
+    def __getitem__(self, field):
+        if field in self._unparsed:
+            self._parse(field)
+        return super(LazyToken, self).__getitem__(field)
+
+    def __setitem__(self, field, value):
+        self._unparsed.pop(field, None)
+        super(LazyToken, self).__setitem__(field, value)
+
+    def __delitem__(self, field):
+        self._unparsed.pop(field, None)
+        super(LazyToken, self).__delitem__(field)
+
+    def get(self, field, default=None):
+        if field in self._unparsed:
+            self._parse(field)
+        return super(LazyToken, self).get(field, default)
+
+    def pop(self, field, *args):
+        if field in self._unparsed:
+            self._parse(field)
+        return super(LazyToken, self).pop(field, *args)
+
+    def values(self):
+        self.parse_all()
+        return super(LazyToken, self).values()
+
+    def items(self):
+        self.parse_all()
+        return super(LazyToken, self).items()
+
+    def copy(self):
+        self.parse_all()
+        return LazyToken(super(LazyToken, self).items())
+
+    def __eq__(self, other):
+        self.parse_all()
+        if isinstance(other, LazyToken):
+            other.parse_all()
+        return super(LazyToken, self).__eq__(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        self.parse_all()
+        return super(LazyToken, self).__repr__()
+
+    def __reduce__(self):
+        # Field parsers are not necessarily picklable, hence parse everything first
+        self.parse_all()
+        return (LazyToken, (list(super(LazyToken, self).items()),))
+
 def parse_comment_line(line, metadata_parsers=None):
     line = line.strip()
 
@@ -1,9 +1,22 @@
-from typing import Sequence, Iterator, NamedTuple
+import hashlib
+import io
+import mmap
+import os
+import pickle
+from array import array
+from collections import OrderedDict
+from typing import Sequence, Iterable, Iterator, NamedTuple, Callable, List, \
+    Optional, Dict, Tuple
 
-from conllu import parse_incr
+from conllu.parallel import DEFAULT_CHUNK_SIZE, map_chunks, read_chunk
 
+import torch
+import torch.nn.utils.rnn as rnn
 import torch.utils.data as data
 
+from neural.types import TT
+from neural.utils import atomic_write
+
 
 # Input word
 Word = str
@@ -26,21 +39,124 @@ class Token(NamedTuple):
 Sent = Sequence[Token]
 
 
+# Annotated sentence converted to index tensors
+class TensorSent(NamedTuple):
+    words: TT   # Word indices
+    upos: TT    # POS tag indices
+    heads: TT   # Dependency heads
+
+    def size(self) -> int:
+        """Return the number of words in the sentence."""
+        return len(self.words)
+
+
+# Target index which is ignored by the loss functions (e.g., the index
+# of the padding positions)
+IGNORE_IX = -100
+
+
+# Batch of `TensorSent`s converted to padded tensors (see `collate`)
+class TensorBatch(NamedTuple):
+    words: TT       # Word indices, of shape [B, N]
+    upos: TT        # POS tag indices, of shape [B, N]
+    heads: TT       # Dependency heads, of shape [B, N]
+    lengths: TT     # Sentence lengths, of shape [B]
+
+
+def collate(batch: Sequence[TensorSent]) -> TensorBatch:
+    """Convert the given batch of sentences to padded tensors.
+
+    The padded positions of the target POS tags and dependency heads are
+    filled with IGNORE_IX (the padded word indices are never used).  This
+    function can be passed as `collate_fn` to a `DataLoader` with worker
+    processes (see `neural.training.train`).
+    """
+    return TensorBatch(
+        words=rnn.pad_sequence(
+            [sent.words for sent in batch], batch_first=True),
+        upos=rnn.pad_sequence(
+            [sent.upos for sent in batch],
+            batch_first=True, padding_value=IGNORE_IX),
+        heads=rnn.pad_sequence(
+            [sent.heads for sent in batch],
+            batch_first=True, padding_value=IGNORE_IX),
+        lengths=torch.LongTensor([len(sent.words) for sent in batch])
+    )
+
+
 def load_data(file_path: str) -> Iterator[Sent]:
     """Load the dataset from a .conllu file."""
     with open(file_path, "r", encoding="utf-8") as data_file:
-        for tok_list in parse_incr(data_file):
-            sent = []
-            for tok in tok_list:
-                form = tok["form"]
-                upos = tok["upostag"]
-                head = tok["head"]
-                # P8 -> Ex3: discard tokens which are not part of the
-                # selected tokenization.  We assume that tokenization is done.
-                if upos != '_':
-                    assert 0 <= head <= len(tok_list)
-                    sent.append(Token(form, upos, head))
-            yield sent
+        yield from read_conllu(data_file)
+
+
+def load_data_parallel(file_path: str, workers: Optional[int] = None,
+                       chunk_size=DEFAULT_CHUNK_SIZE) -> Iterator[Sent]:
+    """Load the dataset from a .conllu file using a pool of `workers`
+    processes, each of which reads a chunk of (roughly) `chunk_size` bytes.
+
+    The sentences are yielded in the same order as by `load_data`.
+    """
+    for sents in map_chunks(
+            read_chunk_sents, file_path,
+            chunk_size=chunk_size, workers=workers):
+        yield from sents
+
+
+def read_chunk_sents(file_path: str, start: int, end: int) -> List[Sent]:
+    """Read the sentences from the given byte range of a .conllu file."""
+    return list(read_conllu(read_chunk(file_path, start, end)))
+
+
+def read_conllu(data_file: Iterable[str]) -> Iterator[Sent]:
+    """Read the sentences from the lines of a .conllu file.
+
+    This is a fast alternative to `conllu.parse_incr`, which only extracts
+    the FORM, UPOS and HEAD columns.  Multiword tokens (e.g. `1-2`) and
+    empty nodes (e.g. `8.1`) are skipped.
+
+    >>> lines = [
+    ...     "# text = Don't go\\n",
+    ...     "1-2\\tDon't\\t_\\t_\\t_\\t_\\t_\\t_\\t_\\t_\\n",
+    ...     "1\\tDo\\tdo\\tAUX\\t_\\t_\\t3\\taux\\t_\\t_\\n",
+    ...     "2\\tn't\\tnot\\tPART\\t_\\t_\\t3\\tadvmod\\t_\\t_\\n",
+    ...     "3\\tgo\\tgo\\tVERB\\t_\\t_\\t0\\troot\\t_\\t_\\n",
+    ...     "\\n",
+    ... ]
+    >>> for tok in next(read_conllu(lines)):
+    ...     print(tok)
+    Token(word='Do', upos='AUX', head=3)
+    Token(word="n't", upos='PART', head=3)
+    Token(word='go', upos='VERB', head=0)
+    """
+    sent = []       # type: List[Token]
+    # Is there a (possibly empty) sentence in progress?
+    in_sent = False
+    for line in data_file:
+        if line == "\n":
+            if in_sent:
+                yield check_heads(sent)
+                sent = []
+                in_sent = False
+            continue
+        in_sent = True
+        if line[0] == "#":
+            continue
+        cols = line.split("\t")
+        tok_id = cols[0]
+        # P8 -> Ex3: discard tokens which are not part of the selected
+        # tokenization.  We assume that tokenization is done.
+        if "-" in tok_id or "." in tok_id or cols[3] == "_":
+            continue
+        sent.append(Token(cols[1], cols[3], int(cols[6])))
+    if in_sent:
+        yield check_heads(sent)
+
+
+def check_heads(sent: List[Token]) -> List[Token]:
+    """Check that the dependency heads in the sentence are in range."""
+    assert all(0 <= tok.head <= len(sent) for tok in sent)
+    return sent
 
 
 class PosDataSet(data.IterableDataset):
@@ -65,17 +181,474 @@ class DiskPosDataSet(PosDataSet):
         return load_data(self.file_path)
 
 
+class IndexedPosDataSet(data.Dataset):
+    """A POS dataset stored on a disk, with random access to sentences.
+
+    A middle ground between `DiskPosDataSet` and `MemPosDataSet`: the file
+    is memory-mapped and only the start positions and the lengths of the
+    sentences are kept in memory (see `build_index`), so that the dataset
+    can be shuffled and loaded by several `DataLoader` workers even if it
+    does not fit in memory.
+    The sentences are decoded on demand, and the last `cache_size` decoded
+    sentences are kept in an LRU cache.
+
+    The index is stored next to the dataset (in a file with the `.idx`
+    suffix) and re-created if it is missing or older than the dataset.
+    """
+
+    def __init__(self, file_path: str, cache_size=0):
+        self.file_path = file_path
+        self.cache_size = cache_size
+        index_path = file_path + ".idx"
+        index = None
+        if os.path.exists(index_path) and \
+                os.path.getmtime(index_path) >= os.path.getmtime(file_path):
+            index = load_index(index_path)
+        if index is None:
+            build_index(file_path, index_path)
+            index = load_index(index_path)
+            assert index is not None
+        # Start positions of the individual sentences (plus the size of the
+        # file), in bytes, and the numbers of their tokens
+        self.offsets, self._lengths = index
+        # The memory map and the cache are created lazily, in each process
+        # which uses the dataset (see `__getstate__`)
+        self._mmap = None       # type: Optional[mmap.mmap]
+        self._cache = OrderedDict()     # type: OrderedDict[int, Sent]
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def lengths(self) -> List[int]:
+        """Return the lengths of the individual sentences, without decoding
+        them (see `neural.training.bucket_loader`).
+        """
+        return self._lengths.tolist()
+
+    def __getitem__(self, ix: int) -> Sent:
+        if not 0 <= ix < len(self):
+            raise IndexError(ix)
+        sent = self._cache.get(ix)
+        if sent is not None:
+            self._cache.move_to_end(ix)
+            return sent
+        sent = self._decode(ix)
+        if self.cache_size > 0:
+            self._cache[ix] = sent
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return sent
+
+    def __iter__(self) -> Iterator[Sent]:
+        for ix in range(len(self)):
+            yield self[ix]
+
+    def _decode(self, ix: int) -> Sent:
+        if self._mmap is None:
+            with open(self.file_path, "rb") as data_file:
+                self._mmap = mmap.mmap(
+                    data_file.fileno(), 0, access=mmap.ACCESS_READ)
+        chunk = self._mmap[self.offsets[ix]:self.offsets[ix+1]]
+        lines = io.StringIO(chunk.decode("utf-8"), newline=None)
+        return next(read_conllu(lines))
+
+    def __getstate__(self):
+        # Memory maps cannot be pickled (e.g., sent to `DataLoader`
+        # workers); each process creates its own map and cache
+        state = self.__dict__.copy()
+        state["_mmap"] = None
+        state["_cache"] = OrderedDict()
+        return state
+
+
+def build_index(file_path: str, index_path: str):
+    """Store the index of the sentences in the given .conllu file in
+    `index_path`: the number of sentences, their start positions (in bytes)
+    followed by the size of the file, and their lengths.
+
+    The sentences are delimited, and their tokens counted, in the same way
+    as in `read_conllu`.
+    """
+    offsets = array('q')
+    lengths = array('q')
+    pos = 0
+    # Is there a (possibly empty) sentence in progress?
+    in_sent = False
+    with open(file_path, "rb") as data_file:
+        for line in data_file:
+            if line == b"\n" or line == b"\r\n":
+                in_sent = False
+            else:
+                if not in_sent:
+                    offsets.append(pos)
+                    lengths.append(0)
+                    in_sent = True
+                if line[0] != ord("#"):
+                    cols = line.split(b"\t")
+                    if not (b"-" in cols[0] or b"." in cols[0]
+                            or cols[3] == b"_"):
+                        lengths[-1] += 1
+            pos += len(line)
+    offsets.append(pos)
+    with atomic_write(index_path) as index_file:
+        array('q', [len(lengths)]).tofile(index_file)
+        offsets.tofile(index_file)
+        lengths.tofile(index_file)
+
+
+def load_index(index_path: str) -> Optional[Tuple[array, array]]:
+    """Load the sentence offsets and lengths stored with `build_index`.
+
+    None is returned if the index file is malformed (e.g., written by
+    an older version of `build_index`).
+    """
+    index = array('q')
+    with open(index_path, "rb") as index_file:
+        index.frombytes(index_file.read())
+    if not index or len(index) != 2 * index[0] + 2:
+        return None
+    num = index[0]
+    return index[1:num+2], index[num+2:]
+
+
 class MemPosDataSet(PosDataSet):
     """A POS dataset stored in memory.
 
     Use this class if speed is more important than memory usage.
+    Set `workers` to load the dataset in parallel (see `load_data_parallel`).
     """
 
-    def __init__(self, file_path: str, sort_by_len=False):
-        self.data_set = list(load_data(file_path))
+    def __init__(self, file_path: str, sort_by_len=False,
+                 workers: Optional[int] = None):
+        if workers is None:
+            self.data_set = list(load_data(file_path))
+        else:
+            self.data_set = list(load_data_parallel(file_path, workers))
         if sort_by_len:
             self.data_set.sort(key=len, reverse=True)
 
     def __iter__(self):
         for elem in self.data_set:
             yield elem
+
+
+class SentView(Sequence[Token]):
+    """A read-only view on a sentence stored in a `ColumnarPosDataSet`.
+
+    The `Token`s are created on demand, so that the view can be used
+    wherever a `Sent` is expected.
+    """
+
+    def __init__(self, corpus: 'ColumnarPosDataSet', start: int, end: int):
+        self.corpus = corpus
+        self.start = start
+        self.end = end
+
+    def __len__(self) -> int:
+        return self.end - self.start
+
+    def __getitem__(self, ix):
+        if isinstance(ix, slice):
+            return [self[i] for i in range(*ix.indices(len(self)))]
+        if ix < 0:
+            ix += len(self)
+        if not 0 <= ix < len(self):
+            raise IndexError(ix)
+        return self.corpus.token(self.start + ix)
+
+    def __iter__(self) -> Iterator[Token]:
+        for pos in range(self.start, self.end):
+            yield self.corpus.token(pos)
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Sequence):
+            return NotImplemented
+        return len(self) == len(other) and list(self) == list(other)
+
+    def __repr__(self) -> str:
+        return repr(list(self))
+
+
+class ColumnarPosDataSet(data.Dataset):
+    """A POS dataset stored in memory in a compact, columnar form.
+
+    Words and POS tags are interned (see `word_vocab` and `pos_vocab`), and
+    the word indices, POS tag indices and dependency heads of all the
+    tokens are stored in flat integer arrays, together with the start
+    positions of the sentences (see `offsets`).  The sentences are accessed
+    as `SentView`s.
+
+    Use this class instead of `MemPosDataSet` for large datasets.
+
+    >>> sents = [[Token('a', 'DET', 2), Token('dog', 'NOUN', 0)],
+    ...          [Token('a', 'DET', 0)]]
+    >>> corpus = ColumnarPosDataSet(sents)
+    >>> len(corpus)
+    2
+    >>> corpus[1]
+    [Token(word='a', upos='DET', head=0)]
+    >>> list(corpus) == sents
+    True
+    >>> corpus.word_vocab
+    ['a', 'dog']
+    """
+
+    def __init__(self, data_set: Iterable[Sent]):
+        # Interned words and POS tags
+        self.word_vocab = []    # type: List[Word]
+        self.pos_vocab = []     # type: List[POS]
+        word_ids = {}           # type: Dict[Word, int]
+        pos_ids = {}            # type: Dict[POS, int]
+        # Token columns
+        self.words = array('i')
+        self.upos = array('i')
+        self.heads = array('i')
+        # Start positions of the individual sentences (plus the end
+        # position of the last sentence)
+        self.offsets = array('q', [0])
+        for sent in data_set:
+            for tok in sent:
+                word_id = word_ids.get(tok.word)
+                if word_id is None:
+                    word_id = word_ids[tok.word] = len(self.word_vocab)
+                    self.word_vocab.append(tok.word)
+                pos_id = pos_ids.get(tok.upos)
+                if pos_id is None:
+                    pos_id = pos_ids[tok.upos] = len(self.pos_vocab)
+                    self.pos_vocab.append(tok.upos)
+                self.words.append(word_id)
+                self.upos.append(pos_id)
+                self.heads.append(tok.head)
+            self.offsets.append(len(self.words))
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def lengths(self) -> List[int]:
+        """Return the lengths of the individual sentences."""
+        return [
+            end - start for start, end in zip(self.offsets, self.offsets[1:])
+        ]
+
+    def __getitem__(self, ix: int) -> SentView:
+        if not 0 <= ix < len(self):
+            raise IndexError(ix)
+        return SentView(self, self.offsets[ix], self.offsets[ix+1])
+
+    def __iter__(self) -> Iterator[SentView]:
+        for ix in range(len(self)):
+            yield self[ix]
+
+    def token(self, pos: int) -> Token:
+        """Return the token at the given position of the token columns."""
+        return Token(
+            self.word_vocab[self.words[pos]],
+            self.pos_vocab[self.upos[pos]],
+            self.heads[pos]
+        )
+
+
+# Version of the preprocessed corpus format (see `save_corpus`); increase it
+# whenever the format changes
+CORPUS_VERSION = 2
+
+# Tensor types of the integer arrays, by type code
+ARRAY_DTYPES = {'i': torch.int32, 'q': torch.int64}
+
+
+def array_tensor(column: array) -> TT:
+    """Return a tensor which shares the memory with the given integer
+    array (which thus cannot be resized while the tensor is in use).
+    """
+    dtype = ARRAY_DTYPES[column.typecode]
+    if len(column) == 0:
+        return torch.zeros(0, dtype=dtype)
+    return torch.frombuffer(column, dtype=dtype)
+
+
+def tensor_array(tensor: TT, typecode: str) -> array:
+    """Copy the given integer tensor to an array with the given type code.
+
+    >>> tensor_array(torch.tensor([1, 2, 3]), 'i')
+    array('i', [1, 2, 3])
+    >>> array_tensor(array('q', [1, 2, 3]))
+    tensor([1, 2, 3])
+    """
+    column = array(typecode, bytes(len(tensor) * array(typecode).itemsize))
+    if len(column) > 0:
+        array_tensor(column).copy_(tensor)
+    return column
+
+
+def long_tensor(column: array) -> TT:
+    """Convert the given integer array to a LongTensor."""
+    return array_tensor(column).long()
+
+
+def file_sha1(file_path: str) -> str:
+    """Return the SHA-1 hash of the given file."""
+    sha1 = hashlib.sha1()
+    with open(file_path, "rb") as in_file:
+        for block in iter(lambda: in_file.read(2**20), b""):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def save_corpus(corpus: ColumnarPosDataSet, source_path: str,
+                corpus_path: str, sha1: Optional[str] = None):
+    """Save the given corpus, read from `source_path`, in a binary form.
+
+    The corpus file is a dictionary, saved with `torch.save`, with the
+    format version, the metadata of the source file, the vocabularies
+    (lists of strings) and the token columns and sentence offsets (integer
+    tensors) of the corpus.  It contains plain data only and it is loaded
+    with `weights_only=True`.  The SHA-1 hash of the source file is
+    calculated unless given.
+    """
+    stat = os.stat(source_path)
+    with atomic_write(corpus_path) as corpus_file:
+        torch.save({
+            'version': CORPUS_VERSION,
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+            'sha1': sha1 or file_sha1(source_path),
+            'word_vocab': corpus.word_vocab,
+            'pos_vocab': corpus.pos_vocab,
+            'words': array_tensor(corpus.words),
+            'upos': array_tensor(corpus.upos),
+            'heads': array_tensor(corpus.heads),
+            'offsets': array_tensor(corpus.offsets),
+        }, corpus_file)
+
+
+def load_corpus(corpus_path: str,
+                source_path: str) -> Optional[ColumnarPosDataSet]:
+    """Load the corpus saved with `save_corpus`.
+
+    None is returned if the corpus file is missing, has a different format
+    version, or does not correspond to the current content of the source
+    file.  The (costly) hash of the source file is only computed if its
+    size or modification time have changed.  If only the modification time
+    has changed (e.g., after `touch`), the corpus is saved again with the
+    new one, so that the source file is not hashed in subsequent calls.
+    """
+    if not os.path.exists(corpus_path):
+        return None
+    try:
+        saved = torch.load(corpus_path, weights_only=True)
+    except (pickle.UnpicklingError, RuntimeError):
+        # E.g., a corpus saved in the (pickled) format of version 1
+        return None
+    if not isinstance(saved, dict) or saved.get('version') != CORPUS_VERSION:
+        return None
+    stat = os.stat(source_path)
+    if stat.st_size != saved['size']:
+        return None
+    touched = stat.st_mtime != saved['mtime']
+    if touched and file_sha1(source_path) != saved['sha1']:
+        return None
+    corpus = ColumnarPosDataSet([])
+    corpus.word_vocab = saved['word_vocab']
+    corpus.pos_vocab = saved['pos_vocab']
+    corpus.words = tensor_array(saved['words'], 'i')
+    corpus.upos = tensor_array(saved['upos'], 'i')
+    corpus.heads = tensor_array(saved['heads'], 'i')
+    corpus.offsets = tensor_array(saved['offsets'], 'q')
+    if touched:
+        save_corpus(corpus, source_path, corpus_path, sha1=saved['sha1'])
+    return corpus
+
+
+def preprocessed(source_path: str,
+                 corpus_path: Optional[str] = None) -> ColumnarPosDataSet:
+    """Load the corpus from the given .conllu file via its preprocessed,
+    binary form (by default, stored next to the source file with the
+    `.corpus` suffix), which is (re-)created if necessary.
+    """
+    if corpus_path is None:
+        corpus_path = source_path + ".corpus"
+    corpus = load_corpus(corpus_path, source_path)
+    if corpus is None:
+        corpus = ColumnarPosDataSet(load_data(source_path))
+        save_corpus(corpus, source_path, corpus_path)
+    return corpus
+
+
+class TensorPosDataSet(data.Dataset):
+    """A POS dataset with sentences converted to index tensors.
+
+    Use this class on top of a `MemPosDataSet` to avoid converting the
+    words, POS tags and dependency heads to indices over and over again
+    (e.g., in each training epoch).  The indices of all the sentences are
+    stored in flat tensors, and each sentence is represented as a view on
+    the corresponding slice (see `offsets`).
+    """
+
+    def __init__(self, data_set: Iterable[Sent],
+                 encode_word: Callable[[Word], int],
+                 encode_pos: Callable[[POS], int]):
+        """Convert the given dataset to index tensors.
+
+        Arguments:
+            data_set: the dataset to convert
+            encode_word: the function which determines word indices
+            encode_pos: the function which determines POS tag indices
+        """
+        words = []      # type: List[int]
+        upos = []       # type: List[int]
+        heads = []      # type: List[int]
+        # Start positions of the individual sentences (plus the end
+        # position of the last sentence)
+        self.offsets = array('q', [0])
+        for sent in data_set:
+            for tok in sent:
+                words.append(encode_word(tok.word))
+                upos.append(encode_pos(tok.upos))
+                heads.append(tok.head)
+            self.offsets.append(len(words))
+        self.words = torch.LongTensor(words)
+        self.upos = torch.LongTensor(upos)
+        self.heads = torch.LongTensor(heads)
+
+    @classmethod
+    def from_columns(cls, corpus: ColumnarPosDataSet,
+                     encode_word: Callable[[Word], int],
+                     encode_pos: Callable[[POS], int]) -> 'TensorPosDataSet':
+        """Convert the given columnar dataset to index tensors.
+
+        Only the interned words and POS tags are encoded; the token columns
+        are then mapped to the resulting indices in one go.
+        """
+        word_ixs = torch.LongTensor(list(map(encode_word, corpus.word_vocab)))
+        pos_ixs = torch.LongTensor(list(map(encode_pos, corpus.pos_vocab)))
+        tensor_set = cls.__new__(cls)
+        tensor_set.offsets = corpus.offsets
+        tensor_set.words = word_ixs[long_tensor(corpus.words)]
+        tensor_set.upos = pos_ixs[long_tensor(corpus.upos)]
+        tensor_set.heads = long_tensor(corpus.heads)
+        return tensor_set
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def lengths(self) -> List[int]:
+        """Return the lengths of the individual sentences (see
+        `neural.training.bucket_loader`).
+        """
+        return [
+            end - start for start, end in zip(self.offsets, self.offsets[1:])
+        ]
+
+    def __getitem__(self, ix: int) -> TensorSent:
+        if not 0 <= ix < len(self):
+            raise IndexError(ix)
+        start, end = self.offsets[ix], self.offsets[ix+1]
+        return TensorSent(
+            self.words[start:end],
+            self.upos[start:end],
+            self.heads[start:end]
+        )
+
+    def __iter__(self) -> Iterator[TensorSent]:
+        for ix in range(len(self)):
+            yield self[ix]
@@ -0,0 +1,23 @@
+"""Export a trained model to TorchScript.
+
+Usage: python export.py MODEL OUTPUT
+
+The model should be saved with `tagger.save_tagger`.  The exported module
+(see `tagger.ScriptTagger`) takes a padded tensor of word indices and the
+sentence lengths, and returns the predicted POS tag indices and heads; the
+POS tags are stored in its `tagset` attribute.  Load it with
+`torch.jit.load`.
+"""
+
+import sys
+
+import torch
+
+from tagger import load_tagger, script_tagger
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        sys.exit(__doc__)
+    model_path, output_path = sys.argv[1:]
+    torch.jit.save(script_tagger(load_tagger(model_path)), output_path)
@@ -1,39 +1,29 @@
 
-from neural.training import train
+from neural.training import train, step_lr
 import data
-from tagger import Tagger, dep_accuracy, total_loss
+from tagger import Tagger, dep_accuracy, total_loss, loss_and_uas, \
+    save_tagger
 from word_embedding import FastText
 
 
-# Training dataset
-train_set = data.MemPosDataSet(
-    "UD_English-ParTUT/en_partut-ud-train.conllu",
-    sort_by_len=True
-)
+# Training dataset (see `preprocess.py`)
+train_set = data.preprocessed("UD_English-ParTUT/en_partut-ud-train.conllu")
 
 # Development dataset
-dev_set = data.MemPosDataSet("UD_English-ParTUT/en_partut-ud-dev.conllu")
+dev_set = data.preprocessed("UD_English-ParTUT/en_partut-ud-dev.conllu")
 
 # Size stats
-print("Train size:", len(list(train_set)))
-print("Dev size:", len(list(dev_set)))
+print("Train size:", len(train_set))
+print("Dev size:", len(dev_set))
 
 # Determine the set of words in the dataset
-word_set = set(
-    tok.word
-    for sent in train_set
-    for tok in sent
-)
+word_set = set(train_set.word_vocab)
 
 # Number of words
 print("Number of words:", len(word_set))
 
 # Determine the POS tagset
-tagset = set(
-    tok.upos
-    for sent in train_set
-    for tok in sent
-)
+tagset = set(train_set.pos_vocab)
 
 # Tagset
 print("Tagset:", tagset)
@@ -49,20 +39,32 @@ word_emb = FastText(
 # Create the tagger
 tagger = Tagger(word_emb, tagset, hid_size=200, hid_dropout=0.5)
 
-# Train the model (see `train` in `neural/training`)
+# Convert the datasets to index tensors once, so that it doesn't have to be
+# done in each training epoch
+train_set = tagger.tensorize(train_set)
+dev_set = tagger.tensorize(dev_set)
+
+# Train the model (see `train` in `neural/training`); the batches are
+# padded in two worker processes, in parallel with training.  The learning
+# rate is decreased ten times after 60 epochs, within the lifetime of the
+# same optimizer.  The training state is checkpointed in each epoch, so
+# that an interrupted run can be simply restarted, and the best model on
+# dev is kept in `tagger.best.pt` (without the fastText embeddings, restore
+# it with `load_training_state`).
 train(
     tagger, train_set, dev_set,
     total_loss, dep_accuracy,
-    epoch_num=60,
+    evaluate=loss_and_uas,
+    collate_fn=data.collate,
+    num_workers=2,
+    epoch_num=80,
     learning_rate=0.01,
-    report_rate=10
+    scheduler=step_lr(60, gamma=0.1),
+    report_rate=10,
+    checkpoint_path="tagger.ckpt",
+    resume_from="tagger.ckpt",
+    best_path="tagger.best.pt"
 )
 
-# Second training phase (with lower learning-rate)
-train(
-    tagger, train_set, dev_set,
-    total_loss, dep_accuracy,
-    epoch_num=20,
-    learning_rate=0.001,
-    report_rate=10
-)
+# Save the trained tagger, e.g. for `tag.py`
+save_tagger(tagger, "tagger.pt")
@@ -30,11 +30,12 @@ class Embedding(nn.Module):
     True
     """
 
-    def __init__(self, alphabet: set, emb_size: int):
+    def __init__(self, alphabet: Iterable, emb_size: int):
         """Create a random embedding dictionary.
 
         Arguments:
-        * alphabet: set of symbols to embed (characters, words, POS tags, ...)
+        * alphabet: distinct symbols to embed (characters, words, POS tags,
+            ...), indexed in the iteration order
         * emb_size: embedding size (each symbol is mapped to a vector
             of size emb_size)
         """
@@ -63,26 +64,33 @@ class Embedding(nn.Module):
         """Return the embedding size."""
         return self.emb_size
 
+    def encode(self, sym) -> int:
+        """Return the index of the given symbol.
+
+        In case of out-of-vocabulary symbol/word, the padding index
+        is returned.
+        """
+        return self.obj_to_ix.get(sym, self.padding_idx)
+
     def forward(self, sym) -> TT:
         """Embed the given symbol."""
-        try:
-            ix = self.obj_to_ix[sym]
-        except KeyError:
-            # In case of out-of-vocabulary symbol/word,
-            # use the padding index
-            ix = self.padding_idx
+        ix = self.encode(sym)
         return self.emb(torch.tensor(ix, dtype=torch.long))
 
     def forwards(self, syms: Iterable) -> TT:
         """Embed the given sequence of symbols (word)."""
-        ixs = []
-        for sym in syms:
-            try:
-                ixs.append(self.obj_to_ix[sym])
-            except KeyError:
-                ixs.append(self.padding_idx)
+        ixs = [self.encode(sym) for sym in syms]
         return self.emb(torch.LongTensor(ixs))
 
+    def forwards_ixs(self, ixs: TT) -> TT:
+        """Embed the symbols given by their indices (see `encode`).
+
+        >>> emb = Embedding(set(['a', 'b']), emb_size=10)
+        >>> ixs = torch.LongTensor([emb.encode('b'), emb.encode('a')])
+        >>> assert (emb.forwards_ixs(ixs) == emb.forwards(['b', 'a'])).all()
+        """
+        return self.emb(ixs)
+
     def forwards_slow(self, syms: Iterable) -> TT:
         """Embed the given sequence of symbols."""
         # This is a default implementation, which is correct but
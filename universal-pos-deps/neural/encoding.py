@@ -1,10 +1,10 @@
-from typing import Iterator, Dict
+from typing import Iterable, Dict, List
 
 
 class Encoding:
 
-    """A class which represents a mapping between (hashable) objects
-    and unique atoms (represented as ints).
+    """A class which represents a frozen mapping between (hashable and
+    comparable) objects and unique atoms (represented as ints).
 
     >>> objects = ["English", "German", "French"]
     >>> enc = Encoding(objects)
@@ -15,18 +15,28 @@ class Encoding:
     True
     >>> for ob in objects:
     ...     ix = enc.encode(ob)
-    ...     assert 0 <= ix < enc.obj_num
+    ...     assert 0 <= ix < enc.size()
     ...     assert ob == enc.decode(ix)
+
+    The objects are sorted before they are assigned their indices.  Hence,
+    the encoding does not depend on the order in which the objects are
+    given (the iteration order of a set can differ between two Python
+    processes, for instance):
+    >>> Encoding(set(objects)).ix_to_obj
+    ['English', 'French', 'German']
+    >>> Encoding(Encoding(objects).ix_to_obj) == Encoding(objects)
+    True
     """
 
-    def __init__(self, objects: Iterator):
-        obj_set = set(ob for ob in objects)
-        self.obj_num = len(obj_set)
+    def __init__(self, objects: Iterable):
+        self.ix_to_obj = sorted(set(objects))  # type: List
         self.obj_to_ix = {}  # type: Dict
-        self.ix_to_obj = {}  # type: Dict
-        for (ix, ob) in enumerate(obj_set):
+        for (ix, ob) in enumerate(self.ix_to_obj):
             self.obj_to_ix[ob] = ix
-            self.ix_to_obj[ix] = ob
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Encoding) \
+            and self.ix_to_obj == other.ix_to_obj
 
     def encode(self, ob) -> int:
         return self.obj_to_ix[ob]
@@ -34,6 +44,6 @@ class Encoding:
     def decode(self, ix: int):
         return self.ix_to_obj[ix]
 
-    def size(self):
+    def size(self) -> int:
         """Return the number of objects in the encoding."""
-        return self.obj_num
+        return len(self.ix_to_obj)
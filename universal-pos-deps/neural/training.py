@@ -1,15 +1,46 @@
-from typing import Optional, Callable, Union
+import os
+import random
+from functools import partial
+from typing import Optional, Callable, Union, Sequence, Iterable, Iterator, \
+    List, Tuple, Any
 
 import torch
 import torch.nn as nn
-from torch.utils.data import Dataset, IterableDataset, DataLoader
+from torch.optim import Optimizer
+from torch.optim.lr_scheduler import StepLR, ReduceLROnPlateau, \
+    CosineAnnealingLR
+from torch.utils.data import Dataset, IterableDataset, DataLoader, Sampler
 
 from neural.types import TT
+from neural.utils import atomic_write
+
+
+def collate_list(batch: List) -> List:
+    """Collate function which leaves the batch as a list of elements.
+
+    Contrary to a lambda, it can be pickled and hence used with
+    `DataLoader` worker processes.
+    """
+    return batch
+
+
+def loader_options(num_workers=0, pin_memory=False,
+                   prefetch_factor: Optional[int] = None) -> dict:
+    """Return the keyword arguments of `DataLoader` which control the
+    worker processes (`prefetch_factor` is only passed if given, since
+    older versions of PyTorch reject it in the single-process mode).
+    """
+    options = {'num_workers': num_workers, 'pin_memory': pin_memory}
+    if prefetch_factor is not None:
+        options['prefetch_factor'] = prefetch_factor
+    return options
 
 
 def batch_loader(data_set: Union[IterableDataset, Dataset],
-                 batch_size: bool,
-                 shuffle=False) -> DataLoader:
+                 batch_size: Optional[int],
+                 shuffle=False,
+                 collate_fn: Callable[[List], Any] = collate_list,
+                 **options) -> DataLoader:
     """Create a batch data loader from the given data set.
 
     Using PyTorch Datasets and DataLoaders is especially useful when working
@@ -54,15 +85,343 @@ def batch_loader(data_set: Union[IterableDataset, Dataset],
     True
     >>> set(x for batch in bl for x in batch) == set(data_set)
     True
+
+    Each batch can be also converted (e.g., to padded tensors) with a
+    `collate_fn`, in the worker processes if `num_workers` is given (see
+    `loader_options` for the additional keyword arguments).
+    >>> bl = batch_loader(data_set, batch_size=2, collate_fn=sum)
+    >>> list(bl)
+    [1, 5, 4]
     """
     return DataLoader(
         data_set,
         batch_size=batch_size,
-        collate_fn=lambda x: x,
-        shuffle=shuffle
+        collate_fn=collate_fn,
+        shuffle=shuffle,
+        **loader_options(**options)
     )
 
 
+def split_batches(
+        ixs: Sequence[int], lengths: Sequence[int],
+        batch_size: Optional[int] = None,
+        max_tokens: Optional[int] = None,
+        quadratic=False) -> List[List[int]]:
+    """Split the given (ordered) sequence of dataset indices into batches.
+
+    A batch is closed when it reaches `batch_size` elements, or when adding
+    another element would make it exceed the budget of `max_tokens`.  The
+    cost of a batch is the number of its elements times the length of the
+    longest element, i.e., the number of tokens in the padded batch.  With
+    `quadratic=True`, the square of the length is used instead, which
+    corresponds to the number of dependency scores in the padded batch.
+    A single element which exceeds the budget forms a batch on its own.
+
+    >>> lengths = [1, 2, 2, 3, 5, 10]
+    >>> split_batches(range(6), lengths, batch_size=4)
+    [[0, 1, 2, 3], [4, 5]]
+    >>> split_batches(range(6), lengths, max_tokens=6)
+    [[0, 1, 2], [3], [4], [5]]
+    >>> split_batches(range(6), lengths, max_tokens=12, quadratic=True)
+    [[0, 1, 2], [3], [4], [5]]
+    """
+    assert batch_size is not None or max_tokens is not None
+    batches = []
+    batch = []      # type: List[int]
+    max_len = 0
+    for ix in ixs:
+        new_len = max(max_len, lengths[ix])
+        if batch:
+            full = batch_size is not None and len(batch) >= batch_size
+            if max_tokens is not None:
+                unit = new_len ** 2 if quadratic else new_len
+                full = full or (len(batch) + 1) * unit > max_tokens
+            if full:
+                batches.append(batch)
+                batch = []
+                new_len = lengths[ix]
+        batch.append(ix)
+        max_len = new_len
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+class BucketSampler(Sampler):
+    """Batch sampler which groups dataset elements of similar length.
+
+    The elements are sorted by length (ties are broken randomly) and split
+    into batches (see `split_batches`).  The order of the batches is
+    shuffled each time the stream of batches is created.
+
+    >>> lengths = [5, 1, 4, 2, 3, 5]
+    >>> sampler = BucketSampler(lengths, batch_size=2)
+    >>> len(sampler)
+    3
+    >>> batches = list(sampler)
+    >>> sorted(sorted(lengths[ix] for ix in batch) for batch in batches)
+    [[1, 2], [3, 4], [5, 5]]
+
+    Batches can be also limited by the number of tokens:
+    >>> sampler = BucketSampler(lengths, max_tokens=10)
+    >>> batches = list(sampler)
+    >>> sorted(sorted(lengths[ix] for ix in batch) for batch in batches)
+    [[1, 2, 3], [4, 5], [5]]
+    """
+
+    def __init__(self, lengths: Sequence[int],
+                 batch_size: Optional[int] = None,
+                 shuffle=True,
+                 max_tokens: Optional[int] = None,
+                 quadratic=False):
+        """Create a bucket sampler.
+
+        Args:
+            lengths: lengths of the individual dataset elements
+            batch_size: (maximal) number of elements in a batch
+            shuffle: shuffle the batches; if False, the batches are
+                sorted by length
+            max_tokens: (maximal) number of tokens in a padded batch
+            quadratic: if True, `max_tokens` bounds the number of
+                squared lengths rather than tokens (see `split_batches`)
+        """
+        self.lengths = lengths
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.max_tokens = max_tokens
+        self.quadratic = quadratic
+
+    def _split(self, ixs: Sequence[int]) -> List[List[int]]:
+        return split_batches(
+            ixs, self.lengths,
+            batch_size=self.batch_size,
+            max_tokens=self.max_tokens,
+            quadratic=self.quadratic
+        )
+
+    def __iter__(self) -> Iterator[List[int]]:
+        if self.shuffle:
+            ixs = torch.randperm(len(self.lengths)).tolist()
+        else:
+            ixs = list(range(len(self.lengths)))
+        # Python sorting is stable, so ties remain in random order
+        ixs.sort(key=lambda ix: self.lengths[ix])
+        batches = self._split(ixs)
+        if self.shuffle:
+            perm = torch.randperm(len(batches)).tolist()
+            batches = [batches[k] for k in perm]
+        return iter(batches)
+
+    def __len__(self) -> int:
+        # The number of batches only depends on the sorted lengths
+        ixs = sorted(range(len(self.lengths)), key=lambda ix: self.lengths[ix])
+        return len(self._split(ixs))
+
+
+class BucketIterable:
+    """Stream of length-bucketed batches over an iterable dataset.
+
+    The dataset is read in pools of `pool_size` consecutive elements.
+    The elements of each pool are grouped by length into batches (see
+    `BucketSampler`), which are then yielded in random order.  Note that
+    the order of the pools themselves is determined by the dataset.
+    """
+
+    def __init__(self, data_set: Iterable,
+                 batch_size: Optional[int] = None,
+                 length: Callable[[Any], int] = len,
+                 shuffle=True,
+                 max_tokens: Optional[int] = None,
+                 quadratic=False,
+                 pool_size=10000,
+                 collate_fn: Callable[[List], Any] = collate_list):
+        self.data_set = data_set
+        self.batch_size = batch_size
+        self.length = length
+        self.shuffle = shuffle
+        self.max_tokens = max_tokens
+        self.quadratic = quadratic
+        self.pool_size = pool_size
+        self.collate_fn = collate_fn
+
+    def __iter__(self) -> Iterator[Any]:
+        pool = []
+        for elem in self.data_set:
+            pool.append(elem)
+            if len(pool) >= self.pool_size:
+                yield from self._batches(pool)
+                pool = []
+        yield from self._batches(pool)
+
+    def _batches(self, pool: List) -> Iterator[Any]:
+        sampler = BucketSampler(
+            [self.length(elem) for elem in pool],
+            batch_size=self.batch_size,
+            shuffle=self.shuffle,
+            max_tokens=self.max_tokens,
+            quadratic=self.quadratic
+        )
+        for batch in sampler:
+            yield self.collate_fn([pool[ix] for ix in batch])
+
+
+def bucket_loader(data_set: Union[IterableDataset, Dataset],
+                  batch_size: Optional[int] = None,
+                  length: Optional[Callable[[Any], int]] = None,
+                  shuffle=True,
+                  max_tokens: Optional[int] = None,
+                  quadratic=False,
+                  collate_fn: Callable[[List], Any] = collate_list,
+                  **options) -> Iterable[Any]:
+    """Create a batch data loader which groups dataset elements of similar
+    length into batches (see `BucketSampler`), and shuffles the batches
+    each time the stream of batches is created.
+
+    This reduces the amount of padding when the elements of a batch are
+    processed together (e.g., by an LSTM), while the order in which the
+    batches are visited changes from epoch to epoch.
+
+    >>> data_set = ["abc", "a", "ab", "abcd", "b", "bc"]
+    >>> bl = bucket_loader(data_set, batch_size=2)
+    >>> sorted(sorted(batch) for batch in bl)
+    [['a', 'b'], ['ab', 'bc'], ['abc', 'abcd']]
+
+    Instead of (or in addition to) the number of elements, the size of the
+    batches can be limited by the number of tokens they contain (padding
+    included), which makes the memory usage more predictable:
+    >>> bl = bucket_loader(data_set, max_tokens=4)
+    >>> sorted(sorted(batch) for batch in bl)
+    [['a', 'b'], ['ab', 'bc'], ['abc'], ['abcd']]
+
+    Iterable datasets (which do not support random access) are also
+    supported.  In this case, elements are bucketed within pools of
+    consecutive dataset elements (see `BucketIterable`).
+    >>> class Stream(IterableDataset):
+    ...     def __iter__(self):
+    ...         return iter(data_set)
+    >>> bl = bucket_loader(Stream(), batch_size=2)
+    >>> sorted(sorted(batch) for batch in bl)
+    [['a', 'b'], ['ab', 'bc'], ['abc', 'abcd']]
+
+    Args:
+        data_set: the dataset to load
+        batch_size: (maximal) number of elements in a batch
+        length: function which determines the length of a dataset element;
+            by default, the lengths are provided by the `lengths` method of
+            the dataset, if any (which avoids retrieving all the elements),
+            or determined with `len` otherwise
+        shuffle: shuffle the batches; if False, batches are sorted by length
+        max_tokens: (maximal) number of tokens in a padded batch
+        quadratic: if True, `max_tokens` bounds the number of squared
+            lengths rather than tokens (see `split_batches`)
+        collate_fn: function applied to each batch (see `batch_loader`)
+        options: worker-related options of the `DataLoader` (see
+            `loader_options`); ignored for iterable datasets, which are
+            loaded in the main process
+    """
+    if isinstance(data_set, IterableDataset):
+        return BucketIterable(
+            data_set, batch_size=batch_size, length=length or len,
+            shuffle=shuffle, max_tokens=max_tokens, quadratic=quadratic,
+            collate_fn=collate_fn)
+    if length is None and hasattr(data_set, 'lengths'):
+        lengths = data_set.lengths()
+    else:
+        length = length or len
+        lengths = [length(data_set[ix]) for ix in range(len(data_set))]
+    sampler = BucketSampler(
+        lengths,
+        batch_size=batch_size,
+        shuffle=shuffle,
+        max_tokens=max_tokens,
+        quadratic=quadratic
+    )
+    return DataLoader(
+        data_set,
+        batch_sampler=sampler,
+        collate_fn=collate_fn,
+        **loader_options(**options)
+    )
+
+
+def atomic_save(obj: Any, file_path: str):
+    """Save the given object with `torch.save`, so that the file is either
+    entirely replaced or left untouched (see `neural.utils.atomic_write`).
+    """
+    with atomic_write(file_path) as out_file:
+        torch.save(obj, out_file)
+
+
+def training_state(model: nn.Module) -> dict:
+    """Return the state_dict of the model without its buffers.
+
+    The buffers are assumed to be constant during training (e.g., the
+    frozen fastText embedding matrix), so there is no need to write them
+    to each checkpoint.  Use `load_training_state` to restore the state.
+    """
+    buffers = set(name for name, _ in model.named_buffers())
+    return {
+        name: value for name, value in model.state_dict().items()
+        if name not in buffers
+    }
+
+
+def load_training_state(model: nn.Module, state: dict):
+    """Restore the state saved with `training_state`; the buffers of the
+    model are left as they are.
+    """
+    buffers = set(name for name, _ in model.named_buffers())
+    missing, unexpected = model.load_state_dict(state, strict=False)
+    if unexpected or not set(missing) <= buffers:
+        raise RuntimeError(
+            "Error(s) in loading the training state: missing keys {}, "
+            "unexpected keys {}".format(
+                sorted(set(missing) - buffers), sorted(unexpected)))
+
+
+def rng_state() -> dict:
+    """Return the state of the random number generators used in training."""
+    state = {
+        'torch': torch.get_rng_state(),
+        'python': random.getstate(),
+    }
+    if torch.cuda.is_available():
+        state['cuda'] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def set_rng_state(state: dict):
+    """Restore the state of the random number generators (see `rng_state`)."""
+    torch.set_rng_state(state['torch'])
+    random.setstate(state['python'])
+    if 'cuda' in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state['cuda'])
+
+
+# Function which creates a learning-rate scheduler for the given optimizer
+SchedulerFactory = Callable[[Optimizer], Any]
+
+
+def step_lr(step_size: int, gamma=0.1) -> SchedulerFactory:
+    """Multiply the learning rate by `gamma` every `step_size` epochs."""
+    return partial(StepLR, step_size=step_size, gamma=gamma)
+
+
+def plateau_lr(factor=0.1, patience=0) -> SchedulerFactory:
+    """Multiply the learning rate by `factor` when the accuracy on dev has
+    not improved for more than `patience` reports (see `train`).
+    """
+    return partial(
+        ReduceLROnPlateau, mode='max', factor=factor, patience=patience)
+
+
+def cosine_lr(epoch_num: int, min_lr=0.0) -> SchedulerFactory:
+    """Anneal the learning rate to `min_lr` over `epoch_num` epochs,
+    following the cosine curve.
+    """
+    return partial(CosineAnnealingLR, T_max=epoch_num, eta_min=min_lr)
+
+
 def train(
         model: nn.Module,
         train_set: IterableDataset,
@@ -72,7 +431,24 @@ def train(
         batch_size=32,
         learning_rate=1e-3,
         report_rate=10,
-        epoch_num=50
+        epoch_num=50,
+        shuffle=True,
+        length: Optional[Callable[[Any], int]] = None,
+        max_tokens: Optional[int] = None,
+        quadratic=False,
+        evaluate: Optional[
+            Callable[[nn.Module, IterableDataset], Tuple[float, float]]
+        ] = None,
+        collate_fn: Callable[[List], Any] = collate_list,
+        num_workers=0,
+        pin_memory=False,
+        prefetch_factor: Optional[int] = None,
+        checkpoint_path: Optional[str] = None,
+        checkpoint_rate=1,
+        resume_from: Optional[str] = None,
+        best_path: Optional[str] = None,
+        scheduler: Optional[SchedulerFactory] = None,
+        patience: Optional[int] = None
 ):
     """Train the model on the given dataset w.r.t. the total_loss function.
     The model parameters are updated in-place.
@@ -83,23 +459,128 @@ def train(
         dev_set: the development dataset (can be None)
         total_loss: the objective function we want to minimize;
             note that this function must support backpropagation!
+            Unless `evaluate` is given, the reported loss on `train_set`
+            is the sum of its values over the batches of `train_set`
         accuracy: accuracy of the model over the given dataset
-        batch_size: size of the SGD batches
+        batch_size: (maximal) size of the SGD batches; can be set to None
+            if `max_tokens` is used
         learning_rate: hyper-parameter of the SGD method
         report_rate: how often to report the loss/accuracy on train/dev
         epoch_num: the number of epochs of the training procedure
+        shuffle: group the dataset elements of similar length into batches
+            and shuffle the batches in each epoch (see `bucket_loader`);
+            otherwise, batches follow the order of the dataset (unless
+            `max_tokens` is used, in which case they are sorted by length)
+        length: function which determines the length of a dataset element
+            (used to group the dataset elements into batches); see
+            `bucket_loader` for the default
+        max_tokens: (maximal) number of tokens in a padded SGD batch
+            (see `bucket_loader`)
+        quadratic: if True, `max_tokens` bounds the number of squared
+            lengths (e.g., dependency scores) rather than tokens
+        evaluate: function which calculates both the loss and the accuracy
+            over the given dataset in a single pass; if provided, it is
+            used for reporting instead of `total_loss` and `accuracy`
+        collate_fn: function which converts each SGD batch (a list of
+            dataset elements) to the input of `total_loss`; it should be
+            picklable if `num_workers` > 0
+        num_workers: the number of `DataLoader` worker processes which
+            load and collate the SGD batches in parallel with training
+        pin_memory: put the collated batches in pinned (page-locked)
+            memory, for faster transfer to the GPU
+        prefetch_factor: the number of batches loaded in advance by
+            each worker
+        checkpoint_path: file in which the training state (the model, the
+            optimizer, the number of epochs done and the state of the
+            random number generators) is saved every `checkpoint_rate`
+            epochs and at the end of training; the buffers of the model
+            are not saved (see `training_state`)
+        checkpoint_rate: how often (in epochs) to save the checkpoint
+        resume_from: checkpoint to resume the training from, if it exists
+            (typically the same as `checkpoint_path`, so that a preempted
+            job can be simply restarted)
+        best_path: file in which the state of the model (without buffers,
+            see `training_state`) is saved each time the accuracy on
+            `dev_set` improves (the accuracy is only calculated every
+            `report_rate` epochs)
+        scheduler: learning-rate scheduler factory (see `step_lr`,
+            `plateau_lr` and `cosine_lr`); the scheduler is stepped after
+            each epoch, except for `plateau_lr`, which is stepped with the
+            accuracy on `dev_set` after each report
+        patience: stop the training when the accuracy on `dev_set` has not
+            improved for `patience` (at least 1) reports in a row; requires
+            `dev_set`
     """
+    if patience is not None:
+        if patience < 1:
+            raise ValueError("patience must be at least 1")
+        if not dev_set:
+            raise ValueError("patience requires a dev_set")
+
     # Choose Adam for optimization
     optimizer = torch.optim.Adam(
         model.parameters(), lr=learning_rate)
+    lr_scheduler = scheduler(optimizer) if scheduler else None
+    on_plateau = isinstance(lr_scheduler, ReduceLROnPlateau)
+
+    # The number of epochs done so far, the best accuracy on dev and
+    # the number of reports since it last improved
+    start_epoch = 0
+    best_acc = None     # type: Optional[float]
+    bad_reports = 0
+    if resume_from is not None and os.path.exists(resume_from):
+        checkpoint = torch.load(resume_from)
+        load_training_state(model, checkpoint['model'])
+        optimizer.load_state_dict(checkpoint['optimizer'])
+        # The checkpoint could have been saved without a scheduler
+        if lr_scheduler is not None and checkpoint['scheduler'] is not None:
+            lr_scheduler.load_state_dict(checkpoint['scheduler'])
+        set_rng_state(checkpoint['rng'])
+        start_epoch = checkpoint['epoch']
+        best_acc = checkpoint['best_acc']
+        bad_reports = checkpoint['bad_reports']
+        print("Resumed from {} @{}".format(resume_from, start_epoch))
+        # The training could have been stopped early
+        if patience is not None and bad_reports >= patience:
+            start_epoch = epoch_num
+
+    def save_checkpoint(epoch: int):
+        if checkpoint_path is not None:
+            atomic_save({
+                'model': training_state(model),
+                'optimizer': optimizer.state_dict(),
+                'scheduler': lr_scheduler.state_dict()
+                if lr_scheduler is not None else None,
+                'rng': rng_state(),
+                'epoch': epoch,
+                'best_acc': best_acc,
+                'bad_reports': bad_reports,
+            }, checkpoint_path)
 
     # Create batched loader
-    batches = batch_loader(
-        # Use no shuffling, it doesn't work with iterable datasets
-        train_set, batch_size=batch_size, shuffle=False)
+    options = dict(
+        num_workers=num_workers,
+        pin_memory=pin_memory,
+        prefetch_factor=prefetch_factor
+    )
+
+    def make_loader(shuffle: bool) -> Iterable[Any]:
+        if shuffle or max_tokens is not None:
+            return bucket_loader(
+                train_set, batch_size=batch_size, length=length,
+                shuffle=shuffle, max_tokens=max_tokens, quadratic=quadratic,
+                collate_fn=collate_fn, **options)
+        return batch_loader(
+            train_set, batch_size=batch_size, shuffle=False,
+            collate_fn=collate_fn, **options)
+
+    batches = make_loader(shuffle)
+    # The loss is reported over the same batches rather than over the
+    # entire training set at once, which could take too much memory
+    report_batches = make_loader(False)
 
     # Perform SGD in a loop
-    for t in range(epoch_num):
+    for t in range(start_epoch, epoch_num):
 
         # We use a PyTorch DataLoader to provide a stream of
         # dataset element batches
@@ -108,16 +589,28 @@ def train(
             optimizer.zero_grad()
             loss.backward()
             optimizer.step()
+        if lr_scheduler is not None and not on_plateau:
+            lr_scheduler.step()
+
+        # Is it the last epoch?
+        last = t+1 == epoch_num
 
         # Reporting (every `report_rate` epochs)
         if (t+1) % report_rate == 0:
             with torch.no_grad():
-                train_loss = total_loss(model, train_set).item()
-                train_acc = accuracy(model, train_set)
-                if dev_set:
-                    dev_acc = accuracy(model, dev_set)
+                if evaluate:
+                    train_loss, train_acc = evaluate(model, train_set)
                 else:
+                    train_loss = sum(
+                        total_loss(model, batch).item()
+                        for batch in report_batches)
+                    train_acc = accuracy(model, train_set)
+                if not dev_set:
                     dev_acc = 0.0
+                elif evaluate:
+                    _, dev_acc = evaluate(model, dev_set)
+                else:
+                    dev_acc = accuracy(model, dev_set)
                 msg = ("@{k}: "
                        "loss(train)={tl}, acc(train)={ta}, "
                        "acc(dev)={da}")
@@ -127,3 +620,24 @@ def train(
                     ta=round(train_acc, 3),
                     da=round(dev_acc, 3))
                 )
+            # Keep the snapshot of the best model on dev
+            if dev_set and (best_acc is None or dev_acc > best_acc):
+                best_acc = dev_acc
+                bad_reports = 0
+                if best_path is not None:
+                    atomic_save(training_state(model), best_path)
+            elif dev_set:
+                bad_reports += 1
+            if lr_scheduler is not None and on_plateau and dev_set:
+                lr_scheduler.step(dev_acc)
+            # Early stopping
+            if patience is not None and bad_reports >= patience:
+                print("@{k}: no improvement on dev in the last {p} reports, "
+                      "stopping".format(k=t+1, p=patience))
+                last = True
+
+        # Checkpointing (every `checkpoint_rate` epochs and at the end)
+        if (t+1) % checkpoint_rate == 0 or last:
+            save_checkpoint(t+1)
+        if last:
+            break
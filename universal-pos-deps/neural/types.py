@@ -1,4 +1,4 @@
 import torch
 
 # Type alias for Tensor type
-TT = torch.TensorType
+TT = torch.Tensor
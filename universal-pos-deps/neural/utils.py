@@ -1,4 +1,7 @@
-from typing import Iterator, List, Any
+from typing import Iterator, List, Any, Tuple, IO
+from contextlib import contextmanager
+import os
+import tempfile
 
 import torch
 import torch.nn as nn
@@ -46,6 +49,52 @@ def flatten(xss: List[List[Any]]) -> List[Any]:
     return ys
 
 
+@contextmanager
+def atomic_write(file_path: str, mode='wb', **kwargs) -> Iterator[IO]:
+    """Open a temporary file which replaces the file at `file_path` once it
+    is successfully written, so that the file is either entirely replaced
+    or left untouched (e.g., if the process is killed in the middle of
+    writing).  The arguments are the same as for `open`.
+
+    The temporary file is created in the target directory, with a unique
+    name, so that the file can be written by several processes at once.
+
+    >>> tmp_dir = tempfile.mkdtemp()
+    >>> path = os.path.join(tmp_dir, "file.txt")
+    >>> with atomic_write(path, 'w') as out_file:
+    ...     _ = out_file.write("abc")
+    >>> open(path).read()
+    'abc'
+    >>> with atomic_write(path, 'w') as out_file:
+    ...     _ = out_file.write("def")
+    ...     raise RuntimeError("interrupted")
+    Traceback (most recent call last):
+    ...
+    RuntimeError: interrupted
+    >>> open(path).read()
+    'abc'
+    >>> os.listdir(tmp_dir)
+    ['file.txt']
+    """
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(file_path) or '.',
+        prefix=os.path.basename(file_path) + '.', suffix='.tmp')
+    try:
+        # `mkstemp` creates the file readable by the owner only
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(tmp_path, 0o666 & ~umask)
+        with open(fd, mode, **kwargs) as tmp_file:
+            yield tmp_file
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
 def round_tt(x: TT, n_digits: int) -> TT:
     """Round the given tensor to `n_digits` decimal places.
 
@@ -84,3 +133,45 @@ def unpack_sequence(pseq: rnn.PackedSequence) -> Iterator[TT]:
     batches, lengths = rnn.pad_packed_sequence(pseq, batch_first=True)
     for batch, length in zip(batches, lengths):
         yield batch[:length]
+
+
+def replace_data(pseq: rnn.PackedSequence, data: TT) -> rnn.PackedSequence:
+    """Create a packed sequence with the structure of `pseq` and the given
+    `data`, aligned with `pseq.data`.
+
+    This allows to apply a (position-wise) function to all the elements
+    of the packed sequence at once, without unpacking it.
+
+    >>> a = torch.tensor([1,2,3])
+    >>> b = torch.tensor([4,5])
+    >>> pseq = rnn.pack_sequence([a, b])
+    >>> useq = list(unpack_sequence(replace_data(pseq, pseq.data * 10)))
+    >>> assert (useq[0] == a * 10).all()
+    >>> assert (useq[1] == b * 10).all()
+    """
+    # The first dimension of `data` must match the packed sequence
+    assert data.shape[0] == pseq.data.shape[0]
+    # This is somewhat low-level and not really recommended by PyTorch
+    # documentation, but avoids unpacking and re-packing the sequence
+    return rnn.PackedSequence(
+        data,
+        batch_sizes=pseq.batch_sizes,
+        sorted_indices=pseq.sorted_indices,
+        unsorted_indices=pseq.unsorted_indices
+    )
+
+
+def pad_packed_data(pseq: rnn.PackedSequence, data: TT) -> Tuple[TT, TT]:
+    """Pad the given `data`, aligned with `pseq.data`, in a batch-first way.
+
+    >>> a = torch.tensor([1,2,3])
+    >>> b = torch.tensor([4,5])
+    >>> pseq = rnn.pack_sequence([a, b])
+    >>> padded, lengths = pad_packed_data(pseq, pseq.data * 10)
+    >>> padded
+    tensor([[10, 20, 30],
+            [40, 50,  0]])
+    >>> lengths
+    tensor([3, 2])
+    """
+    return rnn.pad_packed_sequence(replace_data(pseq, data), batch_first=True)
@@ -0,0 +1,19 @@
+"""Convert .conllu files to the preprocessed, binary corpus format.
+
+Usage: python preprocess.py FILE.conllu [FILE.conllu ...]
+
+Each corpus is stored next to the corresponding .conllu file, with the
+`.corpus` suffix (see `data.preprocessed`).
+"""
+
+import sys
+
+import data
+
+
+if __name__ == '__main__':
+    for source_path in sys.argv[1:]:
+        corpus = data.preprocessed(source_path)
+        print("{}: {} sentences, {} tokens, {} words, {} POS tags".format(
+            source_path + ".corpus", len(corpus), len(corpus.words),
+            len(corpus.word_vocab), len(corpus.pos_vocab)))
@@ -0,0 +1,106 @@
+"""Quantize a trained model and compare it with the original one.
+
+Usage: python quantize.py MODEL DEV.conllu [-o OUTPUT] [--batch-size N]
+
+The LSTM and the linear layers of the model (saved with
+`tagger.save_tagger`) are dynamically quantized to int8 (see
+`tagger.quantize`).  The POS accuracy and UAS of both models on the
+development set are reported, together with their tagging speed, both in
+batches and on individual sentences, and the sizes of the saved models.
+The size of the serialized word embedder (e.g., the fastText embedding
+matrix, which is not quantized) is reported separately from the size of
+the rest of the model (the LSTM and the linear layers).  The quantized
+model is saved to OUTPUT, if given.
+"""
+
+from typing import List, Sequence, Tuple
+import argparse
+import io
+import time
+
+import torch
+
+import data
+from data import Word
+from tagger import Tagger, load_tagger, save_tagger, quantize, \
+    pos_accuracy, dep_accuracy
+
+
+def benchmark(tagger: Tagger, sents: Sequence[List[Word]],
+              batch_size: int, repeat=3) -> float:
+    """Return the (best, over `repeat` runs) time in seconds needed to tag
+    the given sentences in batches of `batch_size` sentences.
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for i in range(0, len(sents), batch_size):
+            tagger.tags(sents[i:i+batch_size])
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def state_size(state: dict) -> int:
+    """Return the size (in bytes) of the serialized state_dict."""
+    buf = io.BytesIO()
+    torch.save(state, buf)
+    return len(buf.getvalue())
+
+
+def model_sizes(tagger: Tagger) -> Tuple[int, int]:
+    """Return the sizes (in bytes) of the serialized state of the word
+    embedder and of the rest of the tagger, respectively.
+    """
+    emb_state, state = {}, {}
+    for name, value in tagger.state_dict().items():
+        if name.startswith('word_emb.'):
+            emb_state[name] = value
+        else:
+            state[name] = value
+    return state_size(emb_state), state_size(state)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('model', help='model saved with `save_tagger`')
+    parser.add_argument('dev', help='development .conllu file')
+    parser.add_argument('-o', '--output', help='quantized model file')
+    parser.add_argument('--batch-size', type=int, default=64,
+                        help='number of sentences tagged at once')
+    args = parser.parse_args()
+
+    tagger = load_tagger(args.model)
+    qtagger = quantize(tagger)
+
+    # The dev set is not preprocessed, so as not to write the `.corpus`
+    # file next to it (see `data.preprocessed`)
+    dev_set = data.ColumnarPosDataSet(data.load_data(args.dev))
+    sents = [[tok.word for tok in sent] for sent in dev_set if len(sent)]
+    print("Dev: {} sentences, {} tokens".format(
+        len(sents), sum(map(len, sents))))
+
+    msg = ("{name}: acc(pos)={pa}, acc(dep)={da}, size(layers)={mb}MB, "
+           "size(emb)={emb}MB, batched={bt}s, single={st}s")
+    results = {}
+    for name, model in [("float32", tagger), ("int8", qtagger)]:
+        tensor_set = model.tensorize(dev_set)
+        results[name] = (
+            pos_accuracy(model, tensor_set, batch_size=args.batch_size),
+            dep_accuracy(model, tensor_set, batch_size=args.batch_size),
+        )
+        emb_size, size = model_sizes(model)
+        print(msg.format(
+            name=name,
+            pa=round(results[name][0], 4),
+            da=round(results[name][1], 4),
+            mb=round(size / 2**20, 2),
+            emb=round(emb_size / 2**20, 2),
+            bt=round(benchmark(model, sents, args.batch_size), 3),
+            st=round(benchmark(model, sents, 1, repeat=1), 3)
+        ))
+    print("Delta: acc(pos)={pa}, acc(dep)={da}".format(
+        pa=round(results["int8"][0] - results["float32"][0], 4),
+        da=round(results["int8"][1] - results["float32"][1], 4)))
+
+    if args.output:
+        save_tagger(qtagger, args.output)
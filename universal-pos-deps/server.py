@@ -0,0 +1,323 @@
+"""Serve a trained model over HTTP.
+
+Usage: python server.py MODEL [--host HOST] [--port PORT] [--workers N]
+                        [--max-batch N] [--max-delay SECONDS]
+
+The model should be saved with `tagger.save_tagger`.  Send POST requests
+with JSON bodies of the form `{"sentences": [["A", "sentence"], ...]}`;
+the response is of the form `{"tags": [[["DET", 2], ["NOUN", 0]], ...]}`,
+i.e., the predicted (UPOS, HEAD) pairs of the individual words.
+
+The model is loaded once, in the main process, and shared with the worker
+processes (see `TaggerServer`).
+"""
+
+from typing import List, Tuple, Dict, Sequence, Optional
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing.process import BaseProcess
+import argparse
+import itertools
+import json
+import multiprocessing as mp
+import queue
+import threading
+import time
+
+import torch
+
+from data import Word, POS, Head
+from tagger import Tagger, load_tagger
+
+
+# Request: identifier and sentences to tag
+Request = Tuple[int, List[List[Word]]]
+
+
+class TaggerServer:
+    """Pool of worker processes which tag the submitted sentences.
+
+    The workers are forked after the tagger is loaded, and the parameters
+    and buffers of the tagger (including the embedding matrix) are moved
+    to shared memory beforehand (see `torch.Tensor.share_memory_`), so
+    that all the workers use a single, read-only copy of the model.
+
+    The requests are micro-batched: a worker which receives a request
+    waits (at most `max_delay` seconds) for further requests, until the
+    batch contains `max_batch` sentences, and then tags all of them in a
+    single call to `Tagger.tags`.
+
+    The workers are monitored by the dispatcher thread (which also
+    completes the futures of the requests).  If a worker dies (e.g., it is
+    killed by the OOM killer), it is replaced with a new one and all the
+    pending requests fail, since it is not known which of them were being
+    tagged by the dead worker.
+
+    >>> server = TaggerServer(tagger).start()       # doctest: +SKIP
+    >>> server.submit([["A", "dog"]]).result()      # doctest: +SKIP
+    [[('DET', 2), ('NOUN', 0)]]
+    >>> server.close()                              # doctest: +SKIP
+    """
+
+    def __init__(self, tagger: Tagger, workers=4, max_batch=64,
+                 max_delay=0.005, threads_per_worker=1, check_interval=1.0):
+        """Create the server (use `start` to start the workers).
+
+        Arguments:
+            tagger: the tagger to serve
+            workers: the number of worker processes
+            max_batch: the (maximal) number of sentences tagged at once
+                (a single request with more sentences is not split)
+            max_delay: latency budget, i.e., the maximal time (in seconds)
+                a worker waits for more requests to fill a batch
+            threads_per_worker: the number of threads used by PyTorch in
+                each worker process
+            check_interval: how often (in seconds) to check if the worker
+                processes are alive
+        """
+        self.tagger = tagger
+        self.workers = workers
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.threads_per_worker = threads_per_worker
+        self.check_interval = check_interval
+        # Forking allows to share the model without pickling it
+        self.ctx = mp.get_context('fork')
+        self.requests = self.ctx.Queue()
+        self.responses = self.ctx.Queue()
+        # Futures of the pending requests, by request identifier
+        self.futures = {}   # type: Dict[int, Future]
+        self.lock = threading.Lock()
+        self.ids = itertools.count()
+        self.procs = []     # type: List[BaseProcess]
+        self.dispatcher = None  # type: Optional[threading.Thread]
+        # Set when the server is closed, so that the workers which exit
+        # are not restarted
+        self.closing = False
+
+    def start(self) -> 'TaggerServer':
+        """Start the worker processes."""
+        self.tagger.eval()
+        self.tagger.share_memory()
+        for _ in range(self.workers):
+            self.procs.append(self._start_worker())
+        self.dispatcher = threading.Thread(target=self._dispatch, daemon=True)
+        self.dispatcher.start()
+        return self
+
+    def _start_worker(self) -> BaseProcess:
+        """Start a single worker process."""
+        proc = self.ctx.Process(
+            target=worker_loop,
+            args=(self.tagger, self.requests, self.responses,
+                  self.max_batch, self.max_delay, self.threads_per_worker),
+            daemon=True)
+        proc.start()
+        return proc
+
+    def submit(self, sents: List[List[Word]]) -> Future:
+        """Submit the sentences for tagging.
+
+        The result of the returned future is the list of the predicted
+        (POS, head) pairs of the individual sentences (see `Tagger.tags`).
+        """
+        future = Future()   # type: Future
+        with self.lock:
+            req_id = next(self.ids)
+            self.futures[req_id] = future
+        self.requests.put((req_id, sents))
+        return future
+
+    def _dispatch(self):
+        """Complete the futures with the responses of the workers, and
+        restart the workers which died (see `_check_workers`).
+        """
+        next_check = time.monotonic() + self.check_interval
+        while True:
+            try:
+                response = self.responses.get(timeout=self.check_interval)
+            except queue.Empty:
+                response = ()
+            if response is None:
+                return
+            if response:
+                req_id, result, error = response
+                with self.lock:
+                    future = self.futures.pop(req_id, None)
+                # The future is missing if the request has already failed
+                if future is not None and error is None:
+                    future.set_result(result)
+                elif future is not None:
+                    future.set_exception(RuntimeError(error))
+            if time.monotonic() >= next_check:
+                self._check_workers()
+                next_check = time.monotonic() + self.check_interval
+
+    def _check_workers(self):
+        """Replace the dead worker processes, if any, with new ones, and
+        fail all the pending requests.
+        """
+        with self.lock:
+            if self.closing:
+                return
+            dead = [ix for ix, proc in enumerate(self.procs)
+                    if not proc.is_alive()]
+            if not dead:
+                return
+            futures = list(self.futures.values())
+            self.futures.clear()
+            for ix in dead:
+                print("Worker {} died with exit code {}, restarting".format(
+                    self.procs[ix].pid, self.procs[ix].exitcode))
+                self.procs[ix] = self._start_worker()
+        for future in futures:
+            future.set_exception(RuntimeError("worker process died"))
+
+    def close(self):
+        """Stop the worker processes."""
+        with self.lock:
+            self.closing = True
+        for _ in self.procs:
+            self.requests.put(None)
+        for proc in self.procs:
+            proc.join()
+        self.responses.put(None)
+        self.dispatcher.join()
+
+
+def worker_loop(tagger: Tagger, requests: mp.Queue, responses: mp.Queue,
+                max_batch: int, max_delay: float, threads: int):
+    """Tag the requests in micro-batches (see `TaggerServer`)."""
+    torch.set_num_threads(threads)
+    while True:
+        req = requests.get()
+        if req is None:
+            return
+        batch = [req]
+        size = len(req[1])
+        # Collect more requests, within the latency budget
+        deadline = time.monotonic() + max_delay
+        stop = False
+        while size < max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                req = requests.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if req is None:
+                stop = True
+                break
+            batch.append(req)
+            size += len(req[1])
+        tag_requests(tagger, batch, responses)
+        if stop:
+            return
+
+
+def tag_requests(tagger: Tagger, batch: Sequence[Request],
+                 responses: mp.Queue):
+    """Tag all the sentences of the given requests at once, and send the
+    results (or the error message) back to the main process.
+    """
+    sents = [sent for _, req_sents in batch for sent in req_sents]
+    try:
+        # Empty sentences cannot be tagged by the LSTM
+        non_empty = [sent for sent in sents if sent]
+        tagged = iter(tagger.tags(non_empty) if non_empty else [])
+        preds = [
+            next(tagged) if sent else []
+            for sent in sents
+        ]   # type: List[List[Tuple[POS, Head]]]
+    except Exception as exc:
+        for req_id, _ in batch:
+            responses.put((req_id, None, repr(exc)))
+        return
+    start = 0
+    for req_id, req_sents in batch:
+        end = start + len(req_sents)
+        responses.put((req_id, preds[start:end], None))
+        start = end
+
+
+def is_sentence_list(sents) -> bool:
+    """Check that the (JSON-decoded) value is a list of sentences, i.e.,
+    lists of words (strings).
+
+    >>> is_sentence_list([["A", "dog"], []])
+    True
+    >>> is_sentence_list("abc")
+    False
+    >>> is_sentence_list(["A", "dog"])
+    False
+    """
+    return isinstance(sents, list) and all(
+        isinstance(sent, list) and all(isinstance(word, str) for word in sent)
+        for sent in sents)
+
+
+def make_handler(server: TaggerServer, timeout: float = 60.0):
+    """Create the HTTP request handler which submits the JSON requests
+    to the given server.
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def do_POST(self):
+            try:
+                size = int(self.headers.get('Content-Length', 0))
+                body = json.loads(self.rfile.read(size).decode('utf-8'))
+                sents = body['sentences']
+            except (ValueError, KeyError, TypeError):
+                self.send_error(400, "Invalid request")
+                return
+            if not is_sentence_list(sents):
+                self.send_error(400, "Invalid request")
+                return
+            try:
+                preds = server.submit(sents).result(timeout=timeout)
+            except Exception as exc:
+                self.send_error(500, repr(exc))
+                return
+            response = json.dumps({'tags': preds}).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(response)))
+            self.end_headers()
+            self.wfile.write(response)
+
+        def log_message(self, format, *args):
+            # Do not log each request
+            pass
+
+    return Handler
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('model', help='model saved with `save_tagger`')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=4,
+                        help='number of worker processes')
+    parser.add_argument('--max-batch', type=int, default=64,
+                        help='maximum number of sentences tagged at once')
+    parser.add_argument('--max-delay', type=float, default=0.005,
+                        help='maximum time (in seconds) spent on waiting '
+                             'for more requests to fill a batch')
+    args = parser.parse_args()
+
+    tagger_server = TaggerServer(
+        load_tagger(args.model), workers=args.workers,
+        max_batch=args.max_batch, max_delay=args.max_delay).start()
+    http_server = ThreadingHTTPServer(
+        (args.host, args.port), make_handler(tagger_server))
+    print("Serving on {}:{}".format(args.host, args.port))
+    try:
+        http_server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        http_server.server_close()
+        tagger_server.close()
@@ -0,0 +1,187 @@
+"""Tag a .conllu or a plain text file with a trained model.
+
+Usage: python tag.py MODEL INPUT [-o OUTPUT] [--text] [--batch-size N]
+                     [--max-tokens N]
+
+The model should be saved with `tagger.save_tagger`.  The input file is
+processed in a streaming fashion, in batches of sentences, and the result
+is written in the CoNLL-U format, with the predicted UPOS and HEAD columns.
+With `--text`, the input file should contain one sentence per line, with
+the words separated by whitespace.
+
+Reading, tagging and writing are pipelined (see `annotate`).
+"""
+
+from typing import Iterable, Iterator, List, Dict, Optional, TextIO, Any
+from collections import OrderedDict
+import argparse
+import itertools
+import queue
+import sys
+import threading
+
+import conllu
+from conllu.models import TokenList
+
+from neural.training import split_batches
+from tagger import Tagger, load_tagger
+
+
+# Marks the end of the stream of items in a pipeline queue
+END = None
+
+
+def read_text(in_file: TextIO) -> Iterator[TokenList]:
+    """Read the whitespace-tokenized sentences, one per line, as token lists
+    (with the other columns left empty).
+    """
+    for line in in_file:
+        words = line.split()
+        if not words:
+            continue
+        tokens = []     # type: List[OrderedDict]
+        for ix, word in enumerate(words, start=1):
+            tok = OrderedDict(
+                (field, None) for field in conllu.DEFAULT_FIELDS
+            )   # type: OrderedDict[str, Any]
+            tok['id'] = ix
+            tok['form'] = word
+            tokens.append(tok)
+        yield TokenList(tokens)
+
+
+def tag_batch(tagger: Tagger, batch: List[TokenList]):
+    """Predict the UPOS tags and heads of the given sentences in place.
+
+    The predictions are stored in the `upostag` and `head` columns of
+    the (syntactic) words; multiword tokens and empty nodes are left
+    untouched.
+    """
+    # Sentences without any (syntactic) words are left untouched
+    words = [words_of(sent) for sent in batch]
+    words = [toks for toks in words if toks]
+    if not words:
+        return
+    preds = tagger.tags([[tok['form'] for tok in toks] for toks in words])
+    for toks, sent_preds in zip(words, preds):
+        for tok, (pos, head) in zip(toks, sent_preds):
+            tok['upostag'] = pos
+            tok['head'] = head
+
+
+def words_of(sent: TokenList) -> List[OrderedDict]:
+    """Return the (syntactic) words of the sentence, i.e., the tokens
+    other than multiword tokens and empty nodes.
+    """
+    return [tok for tok in sent if isinstance(tok['id'], int)]
+
+
+def annotate(tagger: Tagger, sents: Iterable[TokenList], out_file: TextIO,
+             batch_size: Optional[int] = 256,
+             max_tokens: Optional[int] = 5000,
+             pool_size=2000,
+             queue_size=4):
+    """Tag the given sentences and write them to `out_file`, in the input
+    order, with reading, tagging and writing running concurrently.
+
+    * The reader thread consumes `sents` (e.g., `conllu.parse_incr`, in
+      which case parsing happens in this thread) and puts pools of
+      `pool_size` consecutive sentences in the input queue.
+    * The calling thread sorts the sentences of each pool by length,
+      splits them into batches of at most `batch_size` sentences and
+      `max_tokens` padded tokens (see `neural.training.split_batches`),
+      and tags them.
+    * The writer thread serializes the tagged sentences.  Since batches
+      are tagged out of order, the sentences are kept in a reorder buffer
+      until all the preceding sentences have been written.
+
+    The stages are connected with queues of at most `queue_size` items,
+    so that only a bounded number of sentences are kept in memory.
+    """
+    in_queue = queue.Queue(maxsize=queue_size)    # type: queue.Queue
+    out_queue = queue.Queue(maxsize=queue_size)   # type: queue.Queue
+    # Exceptions raised in the reader and writer threads
+    errors = []     # type: List[BaseException]
+
+    def read():
+        try:
+            sent_iter = iter(sents)
+            while True:
+                pool = list(itertools.islice(sent_iter, pool_size))
+                if not pool:
+                    break
+                in_queue.put(pool)
+        except BaseException as exc:
+            errors.append(exc)
+        finally:
+            in_queue.put(END)
+
+    def write():
+        # The number of sentences written so far and the tagged sentences
+        # waiting for the preceding ones, by their position in the input
+        written = 0
+        pending = {}    # type: Dict[int, TokenList]
+        try:
+            for item in iter(out_queue.get, END):
+                pending.update(item)
+                while written in pending:
+                    out_file.write(pending.pop(written).serialize())
+                    written += 1
+        except BaseException as exc:
+            errors.append(exc)
+            # Keep consuming the queue, so that tagging is not blocked
+            for _ in iter(out_queue.get, END):
+                pass
+
+    reader = threading.Thread(target=read, daemon=True)
+    writer = threading.Thread(target=write, daemon=True)
+    reader.start()
+    writer.start()
+    try:
+        # Position of the first sentence of the current pool in the input
+        start = 0
+        for pool in iter(in_queue.get, END):
+            if errors:
+                break
+            lengths = [len(words_of(sent)) for sent in pool]
+            ixs = sorted(range(len(pool)), key=lambda ix: lengths[ix])
+            for batch_ixs in split_batches(
+                    ixs, lengths, batch_size=batch_size,
+                    max_tokens=max_tokens):
+                batch = [pool[ix] for ix in batch_ixs]
+                tag_batch(tagger, batch)
+                out_queue.put([(start + ix, pool[ix]) for ix in batch_ixs])
+            start += len(pool)
+    finally:
+        out_queue.put(END)
+        writer.join()
+    if errors:
+        raise errors[0]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('model', help='model saved with `save_tagger`')
+    parser.add_argument('input', help='input file')
+    parser.add_argument('-o', '--output',
+                        help='output file (stdout if missing)')
+    parser.add_argument('--text', action='store_true',
+                        help='input in plain text, one sentence per line')
+    parser.add_argument('--batch-size', type=int, default=256,
+                        help='maximum number of sentences tagged at once')
+    parser.add_argument('--max-tokens', type=int, default=5000,
+                        help='maximum number of tokens tagged at once')
+    args = parser.parse_args()
+
+    tagger = load_tagger(args.model)
+    with open(args.input, 'r', encoding='utf-8') as in_file:
+        out_file = open(args.output, 'w', encoding='utf-8') \
+            if args.output else sys.stdout
+        if args.text:
+            sents = read_text(in_file)
+        else:
+            sents = conllu.parse_incr(in_file)
+        annotate(tagger, sents, out_file,
+                 batch_size=args.batch_size, max_tokens=args.max_tokens)
+        if out_file is not sys.stdout:
+            out_file.close()
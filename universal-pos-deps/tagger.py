@@ -1,17 +1,26 @@
 
-from typing import Sequence, Iterable, Set, List, Tuple
+from typing import Sequence, Iterable, Set, List, Tuple, Optional, Dict, \
+    NamedTuple, Union
 
 import torch
-from torch import mm
+from torch import mm, bmm
 import torch.nn as nn
+import torch.nn.functional as F
 import torch.nn.utils.rnn as rnn
 
 from neural.types import TT
-from neural.training import batch_loader
+from neural.training import batch_loader, bucket_loader, atomic_save
 from neural.mlp import MLP
+from neural.encoding import Encoding
+from neural.utils import eval_on, pad_packed_data
 
-from data import Word, POS, Head, Sent
-from word_embedding import WordEmbedder
+from data import Word, POS, Head, Sent, TensorSent, TensorPosDataSet, \
+    ColumnarPosDataSet, TensorBatch, IGNORE_IX, collate
+from word_embedding import WordEmbedder, EMBEDDERS
+
+
+# Version of the saved model format (see `save_tagger`)
+MODEL_VERSION = 1
 
 
 class Tagger(nn.Module):
@@ -36,6 +45,9 @@ class Tagger(nn.Module):
         self.word_emb = word_emb
         # Keep the tagset
         self.tagset = tagset
+        # Encoding of the POS tags, which maps the POS tags to the indices
+        # of the POS scores and vice versa
+        self.tag_enc = Encoding(tagset)
         # We keep the size of the hidden layer equal to the embedding size
         self.lstm = nn.LSTM(
             self.word_emb.embedding_size(),
@@ -49,7 +61,7 @@ class Tagger(nn.Module):
         # We use the linear layer to score the embedding vectors
         self.linear_layer = nn.Linear(
             hid_size*2,
-            len(tagset)
+            self.tag_enc.size()
         )
         # Dependent represenetation
         self.dep_repr = MLP(
@@ -63,6 +75,39 @@ class Tagger(nn.Module):
         self.root_repr = nn.Parameter(torch.zeros(hid_size*2))
         # Create the bias vector
         self.bias = nn.Parameter(torch.randn(hid_size*2))
+        # Are the LSTM and the linear layers quantized (see `quantize`)?
+        self.quantized = False
+
+    def hparams(self) -> dict:
+        """Return the hyper-parameters of the tagger (see `__init__`)."""
+        return {
+            'hid_size': self.lstm.hidden_size,
+            'hid_dropout': self.lstm.dropout,
+        }
+
+    def get_extra_state(self) -> dict:
+        """Return the tag encoding, to be stored in the state_dict."""
+        return {'tagset': self.tag_enc.ix_to_obj}
+
+    def set_extra_state(self, state: dict):
+        """Restore the tag encoding from the state_dict."""
+        self.tag_enc = Encoding(state['tagset'])
+        self.tagset = set(self.tag_enc.ix_to_obj)
+
+    def encode_pos(self, pos: POS) -> int:
+        """Return the index of the given POS tag.
+
+        IGNORE_IX is returned for POS tags outside of the tagset.
+        """
+        return self.tag_enc.obj_to_ix.get(pos, IGNORE_IX)
+
+    def tensorize(self, data_set: Iterable[Sent]) -> TensorPosDataSet:
+        """Convert the given dataset to index tensors."""
+        if isinstance(data_set, ColumnarPosDataSet):
+            return TensorPosDataSet.from_columns(
+                data_set, self.word_emb.encode, self.encode_pos)
+        return TensorPosDataSet(
+            data_set, self.word_emb.encode, self.encode_pos)
 
     ###########################################
     # Part I: scoring without batching
@@ -143,18 +188,21 @@ class Tagger(nn.Module):
 
     def embeds(self, sents: Iterable[Sequence[Word]]) -> rnn.PackedSequence:
         """Embed and contextualize (using LSTM) the given batch."""
-        # Embed all the sentences separately (we could further consider
-        # embedding all the sentences at once, but this would require
-        # creating a padded embedding (4-dimensional) tensor)
-        embs = [
-            self.word_emb.forwards(sent)
-            for sent in sents
-        ]
-        # Pack embeddings as a packed sequence
-        packed_embs = rnn.pack_sequence(embs, enforce_sorted=False)
-        # The .data attribute of the packed sequence has the length
-        # of the sum of the sentence lengths
-        assert packed_embs.data.shape[0] == sum(len(semb) for semb in embs)
+        # Embed all the words in the batch at once, directly as a packed
+        # sequence (see `WordEmbedder.forwards_batch`)
+        return self.contextualize(self.word_emb.forwards_batch(sents))
+
+    def embeds_padded(self, words: TT, lengths: TT) -> rnn.PackedSequence:
+        """Embed and contextualize (using LSTM) the given batch of
+        sentences, represented by a padded tensor of word indices of shape
+        [B, N] and the sentence lengths (see `TensorBatch`).
+        """
+        return self.contextualize(
+            self.word_emb.forwards_padded_ixs(words, lengths))
+
+    def contextualize(self, packed_embs: rnn.PackedSequence) \
+            -> rnn.PackedSequence:
+        """Contextualize (using LSTM) the given packed word embeddings."""
         # Apply LSTM to the packed sequence of word embeddings
         packed_hidden, _ = self.lstm(packed_embs)
         # The length of the .data attribute doesn't change (the cumulative
@@ -165,26 +213,29 @@ class Tagger(nn.Module):
         # Return the resulting packed sequence with contextualized embeddings
         return packed_hidden
 
-    def forwards_pos(self, packed_hidden: rnn.PackedSequence) -> List[TT]:
-        """Calculate the POS scores for the individual words."""
+    def forwards_pos_padded(
+            self, packed_hidden: rnn.PackedSequence) -> Tuple[TT, TT]:
+        """Calculate the POS scores for the entire batch at once.
+
+        The result is a pair of:
+        * the padded score tensor of shape [B, N, T], where B is the batch
+          size, N is the length of the longest sentence in the batch and
+          T is the size of the tagset
+        * the lengths of the individual sentences (tensor of shape [B])
+        """
         # Each element of the .data attribute of the hidden packed sequence
         # should now match the input size of the linear scoring layer
         assert packed_hidden.data.shape[1] == self.linear_layer.in_features
         # Apply the linear layer to each element of `packed_hidden.data`
         # individually
         scores_data = self.linear_layer(packed_hidden.data)
-        # Recreate a packed sequence out of the resulting scoring data;
-        # this is somewhat low-level and not really recommended by PyTorch
-        # documentation -- do you know a better way?
-        packed_scores = rnn.PackedSequence(
-            scores_data,
-            batch_sizes=packed_hidden.batch_sizes,
-            sorted_indices=packed_hidden.sorted_indices,
-            unsorted_indices=packed_hidden.unsorted_indices
-        )
-        # Pad the resulting packed sequence
-        padded_scores, padded_len = rnn.pad_packed_sequence(
-            packed_scores, batch_first=True)
+        # Pad the resulting scores
+        return pad_packed_data(packed_hidden, scores_data)
+
+    def forwards_pos(self, packed_hidden: rnn.PackedSequence) -> List[TT]:
+        """Calculate the POS scores for the individual words."""
+        # Calculate the POS scores in a batch
+        padded_scores, padded_len = self.forwards_pos_padded(packed_hidden)
         # Convert the padded representation to a list of score tensors
         scores = []
         for sco, n in zip(padded_scores, padded_len):
@@ -192,20 +243,55 @@ class Tagger(nn.Module):
         # Finally, return the scores
         return scores
 
-    # TODO: optimize this function; currently, it relies on `forward_dep`,
-    # which is not batching-enabled
+    def forwards_dep_padded(
+            self, packed_hidden: rnn.PackedSequence) -> Tuple[TT, TT]:
+        """Calculate the dependency scores for the entire batch at once.
+
+        The result is a pair of:
+        * the padded score tensor of shape [B, N, N+1], where B is the
+          batch size and N is the length of the longest sentence in the
+          batch; [b, i, j] is the score of the j-th word (0 for the dummy
+          root) being the head of the (i+1)-th word in the b-th sentence
+        * the lengths of the individual sentences (tensor of shape [B])
+
+        The scores of the head positions beyond the length of the
+        corresponding sentence are masked out with -inf.
+        """
+        # Calculate the dependent and the head representations of all the
+        # words in the batch at once, using the .data attribute of the
+        # packed sequence
+        D_data = self.dep_repr(packed_hidden.data)
+        H_data = self.hed_repr(packed_hidden.data)
+        # Convert them to padded representations of shape [B, N, 2*hid]
+        D, lengths = pad_packed_data(packed_hidden, D_data)
+        H, _ = pad_packed_data(packed_hidden, H_data)
+        batch_size, sent_len = D.shape[0], D.shape[1]
+        # Add the root dummy vector at the beginning of each sentence
+        root = self.root_repr.view(1, 1, -1).expand(batch_size, 1, -1)
+        H_r = torch.cat([root, H], dim=1)
+        # Transpose the head representations to [B, 2*hid, N+1]
+        H_r = H_r.transpose(1, 2)
+        # Calculate the resulting scores; the bias scores are of shape
+        # [B, 1, N+1] and get broadcast over the dependents
+        scores = bmm(D, H_r) + torch.matmul(self.bias.view(1, 1, -1), H_r)
+        # Mask out the head positions which do not correspond to any word
+        # (note that position 0 stands for the dummy root)
+        positions = torch.arange(sent_len + 1, device=scores.device)
+        mask = positions.view(1, -1) > lengths.to(scores.device).view(-1, 1)
+        scores = scores.masked_fill(mask.unsqueeze(1), float('-inf'))
+        # Make sure that the shape is correct
+        assert scores.shape == (batch_size, sent_len, sent_len + 1)
+        # Return the scores and the lengths
+        return scores, lengths
+
     def forwards_dep(self, packed_hidden: rnn.PackedSequence) -> List[TT]:
         """Calculate the dependency scores for the individual words."""
-        # Convert packed representation to a padded representation
-        padded_hidden, padded_len = rnn.pad_packed_sequence(
-            packed_hidden, batch_first=True
-        )
-        # Split the padded representation into sentences and calculate the
-        # dependency scores using `forward_dep`
+        # Calculate the dependency scores in a batch
+        padded_scores, padded_len = self.forwards_dep_padded(packed_hidden)
+        # Split the padded representation into sentences, removing padding
         scores = []
-        for hidden, n in zip(padded_hidden, padded_len):
-            hidden = hidden[:n]  # Remove padding
-            scores.append(self.forward_dep(hidden))
+        for sco, n in zip(padded_scores, padded_len):
+            scores.append(sco[:n, :n+1])
         # Finally, return the scores
         return scores
 
@@ -222,6 +308,23 @@ class Tagger(nn.Module):
         # Return the scores
         return list(zip(pos_scores, dep_scores))
 
+    def forwards_padded(self, sents: Iterable[Sequence[Word]]) \
+            -> Tuple[TT, TT, TT]:
+        """Calculate the padded score tensors for the given batch.
+
+        The result is a triple of:
+        * POS scores of shape [B, N, T] (see `forwards_pos_padded`)
+        * dependency scores of shape [B, N, N+1] (see `forwards_dep_padded`)
+        * the lengths of the individual sentences (tensor of shape [B])
+        """
+        # Embed and contextualize the entire batch
+        packed_hidden = self.embeds(sents)
+        # Calculate the scores
+        pos_scores, lengths = self.forwards_pos_padded(packed_hidden)
+        dep_scores, _ = self.forwards_dep_padded(packed_hidden)
+        # Return the scores
+        return pos_scores, dep_scores, lengths
+
     ###########################################
     # Part III: tagging (evaluation mode)
     ###########################################
@@ -231,253 +334,480 @@ class Tagger(nn.Module):
         return list(self.tags([sent]))[0]
 
     def tags(self, batch: Sequence[Sequence[Word]]) \
-            -> Iterable[List[Tuple[POS, Head]]]:
+            -> List[List[Tuple[POS, Head]]]:
         """Predict the POS tags and dependency heads in the given batch."""
         # TODO: does it make sense to use `tag` as part of training?
-        with torch.no_grad():
-            # Turn evaluation mode on
-            self.eval()
-            # POS tagging is to be carried out based on the resulting scores
-            pos_scores_batch, dep_scores_batch = zip(*self.forwards(batch))
-            # Turn evaluation mode off
-            self.train()
-            # print("train mode is on:", self.training)
-            for pos_scores, dep_scores, sent in zip(
-                    pos_scores_batch, dep_scores_batch, batch):
-                # Predict POS tags and dependency heads
-                pos_preds = self.predict_pos_tags(pos_scores)
-                dep_preds = self.predict_heads(dep_scores)
-                # We should have as many predicted POS tags and dependency
-                # heads as input words
-                assert len(sent) == len(pos_preds) == len(dep_preds)
-                # Return the predicted POS tags
-                yield list(zip(pos_preds, dep_preds))
+        with torch.no_grad(), eval_on(self):
+            # Calculate the padded scores for the entire batch
+            pos_scores, dep_scores, lengths = self.forwards_padded(batch)
+        # Decode the predictions
+        predictions = self.decode(pos_scores, dep_scores, lengths)
+        # We should have as many predicted POS tags and dependency heads
+        # as input words
+        for sent, preds in zip(batch, predictions):
+            assert len(sent) == len(preds)
+        return predictions
+
+    def decode(self, pos_scores: TT, dep_scores: TT, lengths: TT) \
+            -> List[List[Tuple[POS, Head]]]:
+        """Predict POS tags and dependency heads given the padded scores.
+
+        Arguments:
+        * pos_scores: POS scores of shape [B, N, T]
+        * dep_scores: dependency scores of shape [B, N, N+1]
+        * lengths: lengths of the individual sentences [B]
+
+        See also `forwards_padded`.
+        """
+        # Determine the positions with the highest scores for all the words
+        # in the batch at once; each of the tensors is of shape [B, N]
+        pos_ixs = torch.argmax(pos_scores, dim=2)
+        head_ixs = torch.argmax(dep_scores, dim=2)
+        # Convert the predictions to a nested list of shape [B, N, 2]
+        preds = torch.stack([pos_ixs, head_ixs], dim=2).tolist()
+        # Remove padding and determine the POS tags
+        ix_to_pos = self.tag_enc.ix_to_obj
+        return [
+            [(ix_to_pos[pos_ix], head) for pos_ix, head in sent_preds[:n]]
+            for sent_preds, n in zip(preds, lengths.tolist())
+        ]
+
+    def tags_padded(self, words: TT, lengths: TT) -> Tuple[TT, TT, TT]:
+        """Predict the POS tags and dependency heads in the given batch of
+        sentences, represented by a padded tensor of word indices of shape
+        [B, N] and the sentence lengths (see `TensorBatch`).
+
+        The result is a triple of:
+        * padded POS tag indices of shape [B, N]
+        * padded dependency heads of shape [B, N]
+        * the lengths of the individual sentences (tensor of shape [B])
+        """
+        with torch.no_grad(), eval_on(self):
+            return self.predict_padded(self.embeds_padded(words, lengths))
+
+    def predict_padded(self, packed_hidden: rnn.PackedSequence) \
+            -> Tuple[TT, TT, TT]:
+        """Predict the padded POS tag indices and dependency heads given
+        the contextualized embeddings (see `tags_padded`).
+        """
+        pos_scores, lengths = self.forwards_pos_padded(packed_hidden)
+        dep_scores, _ = self.forwards_dep_padded(packed_hidden)
+        # Determine the positions with the highest scores
+        return \
+            torch.argmax(pos_scores, dim=2), \
+            torch.argmax(dep_scores, dim=2), \
+            lengths
 
     def predict_pos_tags(self, pos_scores: TT) -> List[POS]:
         """Predict POS tags given POS-related scores (single sentence)."""
-        # Sentence length
-        sent_len = len(pos_scores)
-        # List for POS tags
-        pos_predictions = []
-        # For each word, we must select the POS tag corresponding to
-        # the index with the highest score
-        for score_vect in pos_scores:
-            # Determine the position with the highest score
-            ix = torch.argmax(score_vect).item()
-            # Assert the index is within the range of POS tag indices
-            assert 0 <= ix < len(self.tagset)
-            # Determine the corresponding POS tag
-            pos = list(self.tagset)[ix]
-            # Append the new prediction
-            pos_predictions.append(pos)
-        # We should have as many predicted POS tags as input words
-        assert sent_len == len(pos_predictions)
-        # Return the predicted POS tags
-        return pos_predictions
+        # For each word, we select the POS tag corresponding to the index
+        # with the highest score
+        ixs = torch.argmax(pos_scores, dim=1).tolist()
+        # Determine the corresponding POS tags
+        return [self.tag_enc.decode(ix) for ix in ixs]
 
     def predict_heads(self, head_scores: TT) -> List[Head]:
         """Predict dependencies based on the head scores (single sentence)."""
-        # Sentence length
-        sent_len = len(head_scores)
-        # List for dependency heads
-        head_predictions = []
-        for score_vect in head_scores:
-            # Determine the position with the highest score
-            ix = torch.argmax(score_vect).item()
-            # Assert the index is within the range of the possible head indices
-            assert 0 <= ix <= sent_len
-            # Append the new prediction
-            head_predictions.append(ix)
-        # We should have as many predicted POS tags as input words
-        assert sent_len == len(head_predictions)
-        # Return the predictions
-        return head_predictions
+        # For each word, we select the position with the highest score
+        return torch.argmax(head_scores, dim=1).tolist()
+
+
+def eval_loader(data_set: Iterable[TensorSent],
+                batch_size: Optional[int] = 64,
+                max_tokens: Optional[int] = None,
+                quadratic=False) -> Iterable[TensorBatch]:
+    """Create a batch loader for evaluating the tagger on the given dataset.
+
+    The batches are converted to padded tensors (see `data.collate`).
+
+    If `max_tokens` is given, the sentences are grouped by length into
+    batches with a bounded number of (padded) tokens, or dependency scores
+    if `quadratic` is True (see `neural.training.bucket_loader`).
+    Otherwise, the batches of `batch_size` sentences follow the order of
+    the dataset.
+    """
+    if max_tokens is None:
+        return batch_loader(
+            data_set, batch_size=batch_size, collate_fn=collate)
+    return bucket_loader(
+        data_set, batch_size=batch_size, length=TensorSent.size,
+        shuffle=False, max_tokens=max_tokens, quadratic=quadratic,
+        collate_fn=collate)
 
 
 def pos_accuracy(
-        tagger: Tagger, data_set: Iterable[Sent], batch_size=64) -> float:
+        tagger: Tagger, data_set: Iterable[TensorSent],
+        batch_size: Optional[int] = 64,
+        max_tokens: Optional[int] = None,
+        quadratic=False) -> float:
     """Calculate the POS tagging accuracy of the model on the given dataset.
 
     The accuracy is defined as the percentage of the words in the data_set
     for which the model predicts the correct POS tag.
+
+    See `eval_loader` for the description of the batching arguments.
     """
-    k, n = 0., 0.
+    k, n = 0, 0
     # We load the dataset in batches to speed the calculation up
-    for batch in batch_loader(data_set, batch_size=batch_size):
-        # Calculate the input batch
-        inputs = []
-        for sent in batch:
-            # Split the sentence into input words and POS tags
-            words = list(map(lambda tok: tok.word, sent))
-            inputs.append(list(words))
+    batches = eval_loader(data_set, batch_size, max_tokens, quadratic)
+    for batch in batches:
         # Tag all the sentences
-        predictions = tagger.tags(inputs)
-        # Process the predictions and compare with the gold POS tags
-        for sent, pred_poss_deps in zip(batch, predictions):
-            # Extract POS tags
-            pred_poss, _ = zip(*pred_poss_deps)
-            # Split the sentence into input words and POS tags
-            gold_tags = map(lambda tok: tok.upos, sent)
-            for (pred_pos, gold_pos) in zip(pred_poss, gold_tags):
-                if pred_pos == gold_pos:
-                    k += 1.
-                n += 1.
+        pred_pos, _, lengths = tagger.tags_padded(batch.words, batch.lengths)
+        # Compare with the gold POS tags
+        k += count_matches(pred_pos, batch.upos, lengths)
+        n += lengths.sum().item()
     return k / n
 
 
 def dep_accuracy(
-        tagger: Tagger, data_set: Iterable[Sent], batch_size=64) -> float:
+        tagger: Tagger, data_set: Iterable[TensorSent],
+        batch_size: Optional[int] = 64,
+        max_tokens: Optional[int] = None,
+        quadratic=False) -> float:
     """Calculate the unlabeled attachment score (UAS) on the given dataset.
 
     UAS is defined as the percentage of the words in the data_set
     for which the model predicts the correct dependency head.
+
+    See `eval_loader` for the description of the batching arguments.
     """
-    k, n = 0., 0.
+    k, n = 0, 0
     # We load the dataset in batches to speed the calculation up
-    for batch in batch_loader(data_set, batch_size=batch_size):
-        # Calculate the input batch
-        inputs = []
-        for sent in batch:
-            # Split the sentence into input words and POS tags
-            words = list(map(lambda tok: tok.word, sent))
-            inputs.append(list(words))
+    batches = eval_loader(data_set, batch_size, max_tokens, quadratic)
+    for batch in batches:
         # Tag all the sentences
-        predictions = tagger.tags(inputs)
-        # Process the predictions and compare with the gold POS tags
-        for sent, pred_poss_deps in zip(batch, predictions):
-            # Extract dependency heads
-            _, pred_heads = zip(*pred_poss_deps)
-            # Split the sentence into input words and POS tags
-            gold_heads = map(lambda tok: tok.head, sent)
-            for (pred_pos, gold_pos) in zip(pred_heads, gold_heads):
-                if pred_pos == gold_pos:
-                    k += 1.
-                n += 1.
+        _, pred_heads, lengths = tagger.tags_padded(
+            batch.words, batch.lengths)
+        # Compare with the gold dependency heads
+        k += count_matches(pred_heads, batch.heads, lengths)
+        n += lengths.sum().item()
     return k / n
 
 
-def pos_loss(tagger: Tagger, data_set: Iterable[Sent]) -> TT:
+def count_matches(pred: TT, gold: TT, lengths: TT) -> int:
+    """Count the positions, outside of padding, where the padded tensors
+    `pred` and `gold` (both of shape [B, N]) match.
+    """
+    assert pred.shape == gold.shape
+    positions = torch.arange(pred.shape[1])
+    mask = positions.view(1, -1) < lengths.view(-1, 1)
+    return ((pred == gold) & mask).sum().item()
+
+
+def pos_loss(tagger: Tagger, data_set: Iterable[TensorSent]) -> TT:
     """The POS tagging-related cross entropy loss over the given dataset."""
-    # Create two lists for target indices (corresponding to POS tags we
-    # want our mode to predict) and the actually predicted scores.
-    target_ixs = []     # type: List[int]
-    inputs = []         # type: List[Sequence[Word]]
-    # Loop over the dataset in order to determine the target POS tags
-    # and the predictions
-    for sent in data_set:
-        # Unzip the sentence into a (list of words, list of target POS tags)
-        words = list(map(lambda tok: tok.word, sent))
-        gold_tags = map(lambda tok: tok.upos, sent)
-        # DONE: Determine the target POS tag indices and update `target_ixs`
-        for tag in gold_tags:
-            # Determine the index corresponding to the POS gold_tag
-            ix = list(tagger.tagset).index(tag)
-            # Append it to the target list
-            target_ixs.append(ix)
-        # Append the new sentence to the inputs list
-        inputs.append(words)
-    # Calculate the scores in a batch and concat them
-    pos_scores, _ = zip(*tagger.forwards(inputs))
-    pos_scores = torch.cat(pos_scores)
-    # Convert the target indices to a tensor
-    target_ixs = torch.LongTensor(target_ixs)
-    # Make sure the dimensions match
-    assert target_ixs.shape[0] == pos_scores.shape[0]
-    # Assert that target_ixs is a vector (1d tensor)
-    assert target_ixs.dim() == 1
-    # The second dimension of the predicted scores
+    # Determine the padded input sentences and target POS tag indices
+    batch = collate(list(data_set))
+    # Calculate the padded scores in a batch
+    pos_scores, _ = tagger.forwards_pos_padded(
+        tagger.embeds_padded(batch.words, batch.lengths))
+    # The third dimension of the predicted scores
     # should correspond to the size of the tagset:
-    assert pos_scores.shape[1] == len(tagger.tagset)
-    # Calculate the loss and return it
-    loss = nn.CrossEntropyLoss()
-    return loss(pos_scores, target_ixs)
+    tagset_size = pos_scores.shape[2]
+    assert tagset_size == len(tagger.tagset)
+    # Calculate the loss and return it; the padded positions are
+    # ignored (see `data.collate`)
+    loss = nn.CrossEntropyLoss(ignore_index=IGNORE_IX)
+    return loss(
+        pos_scores.reshape(-1, tagset_size), batch.upos.reshape(-1))
+
+
+def padded_loss(pred_pos_scores: TT, pred_head_scores: TT,
+                target_pos_ixs: TT, target_heads: TT) -> TT:
+    """Calculate the total cross entropy loss given the padded scores
+    (see `Tagger.forwards_padded`) and the padded targets (see
+    `data.collate`).
+    """
+    # Check dimensions: [B, N] for the targets
+    batch_size, sent_len = target_heads.shape
+    assert target_pos_ixs.shape == (batch_size, sent_len)
+
+    # Create a cross entropy object
+    loss = nn.CrossEntropyLoss(reduction='sum', ignore_index=IGNORE_IX)
+
+    #########################################################
+    # Calculate the POS tagging-related loss
+    #########################################################
+
+    # Check dimensions: [B, N, T] for the scores
+    tagset_size = pred_pos_scores.shape[2]
+    assert pred_pos_scores.shape == (batch_size, sent_len, tagset_size)
+    # Calculate the POS tagging-related loss
+    pos_loss = loss(
+        pred_pos_scores.reshape(batch_size * sent_len, tagset_size),
+        target_pos_ixs.reshape(batch_size * sent_len)
+    )
+
+    #########################################################
+    # Calculate the dependency parsing-related loss
+    #########################################################
+
+    # Check dimensions: [B, N, N+1] for the scores
+    assert pred_head_scores.shape == (batch_size, sent_len, sent_len + 1)
+    # Calculate the loss for all the sentences at once; this gives the
+    # same result as summing up the losses of the individual sentences
+    dep_loss = loss(
+        pred_head_scores.reshape(batch_size * sent_len, sent_len + 1),
+        target_heads.reshape(batch_size * sent_len)
+    )
+
+    # Return the sum of POS loss and dependency loss
+    return pos_loss + dep_loss
 
 
-def total_loss(tagger: Tagger, data_set: Iterable[Sent]) -> TT:
+def total_loss(tagger: Tagger,
+               data_set: Union[TensorBatch, Iterable[TensorSent]]) -> TT:
     """Calculate the total cross entropy loss over the given dataset.
 
     The total loss is defined as the sum of:
     * the POS tagging-related loss and
     * the dependency parsing-related loss
+
+    The dataset can be also given as a batch already converted to padded
+    tensors (see `data.collate`), e.g., by the `DataLoader` workers.
+    """
+    # The sentences are already converted to index tensors (see
+    # `TensorPosDataSet`), we only need to pad them
+    if isinstance(data_set, TensorBatch):
+        batch = data_set
+    else:
+        batch = collate(list(data_set))
+    # Embed and contextualize the entire batch
+    packed_hidden = tagger.embeds_padded(batch.words, batch.lengths)
+    # Calculate the padded POS and dependency scores
+    pred_pos_scores, _ = tagger.forwards_pos_padded(packed_hidden)
+    pred_head_scores, _ = tagger.forwards_dep_padded(packed_hidden)
+    # Calculate the loss
+    assert pred_pos_scores.shape[2] == len(tagger.tagset)
+    return padded_loss(
+        pred_pos_scores, pred_head_scores, batch.upos, batch.heads)
+
+
+class Evaluation(NamedTuple):
+    """Result of the evaluation of the tagger on a dataset."""
+    # Total loss (see `total_loss`)
+    loss: float
+    # POS tagging accuracy (see `pos_accuracy`)
+    pos_acc: float
+    # Unlabeled attachment score (see `dep_accuracy`)
+    uas: float
+    # For each POS tag, the number of words with this gold POS tag for
+    # which the tag was correctly predicted, and the number of all words
+    # with this gold POS tag
+    pos_counts: Dict[POS, Tuple[int, int]]
+
+
+def evaluate(
+        tagger: Tagger, data_set: Iterable[TensorSent],
+        batch_size: Optional[int] = 64,
+        max_tokens: Optional[int] = None,
+        quadratic=False) -> Evaluation:
+    """Evaluate the tagger on the given dataset in a single pass.
+
+    This is faster than calculating the loss, the POS accuracy and the UAS
+    separately, since the scores are calculated only once.
+
+    See `eval_loader` for the description of the batching arguments.
+    """
+    tagset_size = tagger.tag_enc.size()
+    loss = 0.0
+    pos_k, dep_k, n = 0, 0, 0
+    pos_k_per_tag = torch.zeros(tagset_size, dtype=torch.long)
+    pos_n_per_tag = torch.zeros(tagset_size, dtype=torch.long)
+    with torch.no_grad(), eval_on(tagger):
+        for batch in eval_loader(data_set, batch_size, max_tokens, quadratic):
+            # Calculate the padded scores
+            target_pos_ixs, target_heads = batch.upos, batch.heads
+            packed_hidden = tagger.embeds_padded(batch.words, batch.lengths)
+            pos_scores, _ = tagger.forwards_pos_padded(packed_hidden)
+            dep_scores, _ = tagger.forwards_dep_padded(packed_hidden)
+            # Update the loss
+            loss += padded_loss(
+                pos_scores, dep_scores, target_pos_ixs, target_heads).item()
+            # Determine the predictions and compare them with the targets;
+            # the padded positions are those with IGNORE_IX heads
+            mask = target_heads != IGNORE_IX
+            pred_pos_ixs = torch.argmax(pos_scores, dim=2)
+            pred_heads = torch.argmax(dep_scores, dim=2)
+            pos_ok = (pred_pos_ixs == target_pos_ixs) & mask
+            dep_ok = (pred_heads == target_heads) & mask
+            pos_k += pos_ok.sum().item()
+            dep_k += dep_ok.sum().item()
+            n += mask.sum().item()
+            # Update the per-tag counts (note that gold POS tags outside of
+            # the tagset are encoded as IGNORE_IX and not accounted for)
+            known = target_pos_ixs != IGNORE_IX
+            pos_n_per_tag += torch.bincount(
+                target_pos_ixs[known], minlength=tagset_size)
+            pos_k_per_tag += torch.bincount(
+                target_pos_ixs[pos_ok], minlength=tagset_size)
+    pos_counts = {
+        tagger.tag_enc.decode(ix): (k, m)
+        for ix, (k, m) in enumerate(
+            zip(pos_k_per_tag.tolist(), pos_n_per_tag.tolist()))
+    }
+    return Evaluation(
+        loss=loss, pos_acc=pos_k / n, uas=dep_k / n, pos_counts=pos_counts)
+
+
+def loss_and_uas(tagger: Tagger, data_set: Iterable[TensorSent]) \
+        -> Tuple[float, float]:
+    """Calculate the total loss and the UAS in a single pass (see
+    `evaluate`).
     """
+    evaluation = evaluate(tagger, data_set)
+    return evaluation.loss, evaluation.uas
 
-    #########################################################
-    # Calculate the inputs and the target outputs
-    #########################################################
 
-    # Create a list for input sentences
-    inputs = []          # type: List[Sequence[Word]]
-
-    # Create two lists for target indices (POS tags and dep head indices)
-    target_pos_ixs = []  # type: List[int]
-    target_heads = []    # type: List[TT]
-
-    # Loop over the dataset to determine target indices and input words
-    for sent in data_set:
-        # Extract the input words, gold POS tags, and gold dependency heads
-        words = map(lambda tok: tok.word, sent)
-        gold_tags = map(lambda tok: tok.upos, sent)
-        gold_heads = map(lambda tok: tok.head, sent)
-        # Append the new sentence to the inputs list
-        inputs.append(list(words))
-        # Determine the target POS tag indices
-        for tag in gold_tags:
-            # Determine the index corresponding to the gold POS tag
-            ix = list(tagger.tagset).index(tag)
-            # Append it to the target list
-            target_pos_ixs.append(ix)
-        # Append gold heads tensor to the target heads list
-        target_heads.append(torch.LongTensor(list(gold_heads)))
-
-    # Convert the target POS indices into a tensor (so its type
-    # is now simply TT)
-    target_pos_ixs = torch.LongTensor(target_pos_ixs)
+class ScriptTagger(nn.Module):
+    """Inference-only version of the tagger which can be compiled with
+    `torch.jit.script` (see `script_tagger`).
 
-    #########################################################
-    # Calculate the scores with the model
-    #########################################################
+    The input is a padded tensor of word indices of shape [B, N] (see
+    `Tagger.tensorize` and `data.collate`) and the lengths of the
+    sentences, and the output is a pair of padded tensors of shape [B, N]
+    with the predicted POS tag indices (see `tagset`) and dependency heads.
+    This is the same as `Tagger.tags_padded`, with all the computations
+    expressed as tensor operations.
 
-    # Calculate all the scores in a batch
-    pred_pos_scores, pred_head_scores = zip(*tagger.forwards(inputs))
+    The modules and parameters are shared with the original tagger, so
+    the module should be used in the evaluation mode (see `script_tagger`).
+    """
 
-    #########################################################
-    # Calculate the POS tagging-related loss
-    #########################################################
+    # POS tags, by their indices
+    tagset: List[str]
+
+    def __init__(self, tagger: Tagger):
+        super(ScriptTagger, self).__init__()
+        self.tagset = list(tagger.tag_enc.ix_to_obj)
+        self.register_buffer(
+            'embedding', tagger.word_emb.embedding_matrix().detach())
+        self.lstm = tagger.lstm
+        self.linear_layer = tagger.linear_layer
+        self.dep_repr = tagger.dep_repr
+        self.hed_repr = tagger.hed_repr
+        self.root_repr = tagger.root_repr
+        self.bias = tagger.bias
+
+    def forward(self, words: TT, lengths: TT) -> Tuple[TT, TT]:
+        """Predict the POS tag indices and the dependency heads."""
+        batch_size, sent_len = words.shape[0], words.shape[1]
+        # Embed and contextualize the words
+        embs = F.embedding(words, self.embedding)
+        packed_embs = rnn.pack_padded_sequence(
+            embs, lengths.cpu(), batch_first=True, enforce_sorted=False)
+        packed_hidden, _ = self.lstm(packed_embs)
+        hidden, _ = rnn.pad_packed_sequence(
+            packed_hidden, batch_first=True, total_length=sent_len)
+        # POS tags
+        pos_ixs = torch.argmax(self.linear_layer(hidden), dim=2)
+        # Dependency scores (see `Tagger.forwards_dep_padded`)
+        D = self.dep_repr(hidden)
+        H = self.hed_repr(hidden)
+        root = self.root_repr.view(1, 1, -1).expand(batch_size, 1, -1)
+        H_r = torch.cat([root, H], dim=1).transpose(1, 2)
+        scores = bmm(D, H_r) + torch.matmul(self.bias.view(1, 1, -1), H_r)
+        positions = torch.arange(sent_len + 1, device=scores.device)
+        mask = positions.view(1, -1) > lengths.to(scores.device).view(-1, 1)
+        scores = scores.masked_fill(mask.unsqueeze(1), float('-inf'))
+        heads = torch.argmax(scores, dim=2)
+        return pos_ixs, heads
+
+
+def script_tagger(tagger: Tagger) -> torch.jit.ScriptModule:
+    """Compile the tagger with TorchScript (see `ScriptTagger`).
+
+    The resulting module, in the evaluation mode, can be saved with
+    `torch.jit.save` and run without the Python code of the tagger (e.g.,
+    from C++).
+
+    The scripted module gives the same predictions as `Tagger.tags_padded`:
+    >>> from word_embedding import AtomicEmbedder
+    >>> emb = AtomicEmbedder(set(["a", "cat", "dog"]), emb_size=10)
+    >>> tagger = Tagger(emb, set(["DET", "NOUN"]), hid_size=8)
+    >>> scripted = script_tagger(tagger)
+    >>> words = torch.LongTensor([
+    ...     [emb.encode("a"), emb.encode("cat"), emb.encode("dog")],
+    ...     [emb.encode("dog"), emb.encode("a"), emb.encode("a")]])
+    >>> lengths = torch.LongTensor([3, 1])
+    >>> pos_ixs, heads = scripted(words, lengths)
+    >>> pos_ixs2, heads2, _ = tagger.tags_padded(words, lengths)
+    >>> mask = torch.arange(3).view(1, -1) < lengths.view(-1, 1)
+    >>> assert (pos_ixs[mask] == pos_ixs2[mask]).all()
+    >>> assert (heads[mask] == heads2[mask]).all()
+    """
+    scripted = torch.jit.script(ScriptTagger(tagger))
+    scripted.eval()
+    return scripted
 
-    # Concatenate POS scores
-    pred_pos_scores = torch.cat(pred_pos_scores)
-    # Check dimensions
-    assert target_pos_ixs.dim() == 1
-    assert pred_pos_scores.dim() == 2
-    assert pred_pos_scores.shape[0] == sum(len(sent) for sent in inputs)
-    assert pred_pos_scores.shape[0] == target_pos_ixs.shape[0]
-    assert pred_pos_scores.shape[1] == len(tagger.tagset)
-    # Create a cross entropy object
-    loss = nn.CrossEntropyLoss(reduction='sum')
-    # Calculate the POS tagging-related loss
-    pos_loss = loss(pred_pos_scores, target_pos_ixs)
 
-    #########################################################
-    # Calculate the dependency parsing-related loss
-    #########################################################
+def quantize(tagger: Tagger) -> Tagger:
+    """Return a copy of the tagger, for CPU inference, in which the LSTM
+    and the linear layers (including those of the MLPs) are dynamically
+    quantized to int8.
 
-    # Store the dependency parsing loss in a variable
-    dep_loss = 0.0
-    # Calculate the loss for each sentence separately (this could be further
-    # optimized using padding)
-    for sent, pred, target in zip(inputs, pred_head_scores, target_heads):
-        # Check dimensions
-        assert target.dim() == 1
-        assert pred.dim() == 2
-        assert pred.shape[0] == target.shape[0] == len(sent)
-        assert pred.shape[1] == len(sent) + 1
-        # Calculate the loss using the beforehand created nn.CrossEntropyLoss
-        # object and update the total dependency loss
-        dep_loss += loss(pred, target)
+    The weights are stored as int8 and the activations are quantized on
+    the fly.  The word embeddings and the other parameters (e.g., the
+    representation of the dummy root) are left as they are.  Note that
+    the quantized tagger cannot be trained.
+    """
+    with eval_on(tagger):
+        qtagger = torch.quantization.quantize_dynamic(
+            tagger, {nn.LSTM, nn.Linear}, dtype=torch.qint8)
+    qtagger.eval()
+    qtagger.quantized = True
+    return qtagger
 
-    #########################################################
-    # Return the total loss
-    #########################################################
 
-    # Return the sum of POS loss and dependency loss
-    return pos_loss + dep_loss
+def save_tagger(tagger: Tagger, file_path: str):
+    """Save the tagger, so that it can be loaded with `load_tagger`.
+
+    Along with the state_dict, the saved model contains the version of
+    the format, the class and the configuration (e.g., the vocabulary) of
+    the word embedder, the tagset and the hyper-parameters of the tagger.
+    Quantized taggers (see `quantize`) are also supported.
+    """
+    atomic_save({
+        'version': MODEL_VERSION,
+        'embedder': type(tagger.word_emb).__name__,
+        'embedder_config': tagger.word_emb.config(),
+        'tagset': tagger.tag_enc.ix_to_obj,
+        'hparams': tagger.hparams(),
+        'quantized': tagger.quantized,
+        'state_dict': tagger.state_dict(),
+    }, file_path)
+
+
+def load_tagger(file_path: str) -> Tagger:
+    """Load the tagger saved with `save_tagger`.
+
+    Quantized taggers can be saved and loaded as well:
+    >>> import os, tempfile
+    >>> from word_embedding import AtomicEmbedder
+    >>> emb = AtomicEmbedder(set(["a", "cat"]), emb_size=10)
+    >>> qtagger = quantize(Tagger(emb, set(["DET", "NOUN"]), hid_size=8))
+    >>> with tempfile.TemporaryDirectory() as tmp_dir:
+    ...     path = os.path.join(tmp_dir, "tagger.pt")
+    ...     save_tagger(qtagger, path)
+    ...     qtagger2 = load_tagger(path)
+    >>> qtagger2.quantized
+    True
+    >>> sents = [["a", "cat"], ["cat"]]
+    >>> assert qtagger2.tags(sents) == qtagger.tags(sents)
+    """
+    # The packed parameters of the quantized modules are not plain tensors
+    # and cannot be unpickled with `weights_only=True`; the model files are
+    # assumed to be trusted (they are produced by `save_tagger`)
+    model = torch.load(file_path, weights_only=False)
+    if model['version'] != MODEL_VERSION:
+        raise ValueError("{}: unsupported model version {}".format(
+            file_path, model['version']))
+    emb_class = EMBEDDERS[model['embedder']]
+    word_emb = emb_class.from_config(model['embedder_config'])
+    tagger = Tagger(word_emb, set(model['tagset']), **model['hparams'])
+    # The state of the quantized modules can be only loaded to the
+    # quantized modules
+    if model.get('quantized', False):
+        tagger = quantize(tagger)
+    tagger.load_state_dict(model['state_dict'])
+    return tagger
@@ -1,13 +1,17 @@
-from typing import Iterable, Set
+from typing import Iterable, Sequence, Set, Dict, Type
 
 from abc import ABC, abstractmethod
+from array import array
 import io
+import os
 
 import torch
 import torch.nn as nn
+import torch.nn.utils.rnn as rnn
 
 from data import Word
 from neural.types import TT
+from neural.utils import replace_data, atomic_write
 from neural.embedding import Embedding
 
 
@@ -25,11 +29,85 @@ class WordEmbedder(ABC, nn.Module):
         # in a sub-class.
         return torch.stack([self.forward(word) for word in words])
 
+    def forwards_batch(self, sents: Iterable[Sequence[Word]]) \
+            -> rnn.PackedSequence:
+        """Embed the given batch of sentences as a packed sequence.
+
+        All the words in the batch are embedded at once, in the order of
+        the resulting packed sequence.
+        """
+        ixs = [
+            torch.LongTensor([self.encode(word) for word in sent])
+            for sent in sents
+        ]
+        return self.forwards_batch_ixs(ixs)
+
+    def forwards_batch_ixs(self, sents: Sequence[TT]) -> rnn.PackedSequence:
+        """Embed the given batch of sentences, represented by word index
+        tensors (see `encode`), as a packed sequence.
+        """
+        # Pack the indices first, so that the embedding vectors can be
+        # retrieved directly in the order of the packed sequence
+        packed_ixs = rnn.pack_sequence(sents, enforce_sorted=False)
+        embs = self.forwards_ixs(packed_ixs.data)
+        return replace_data(packed_ixs, embs)
+
+    def forwards_padded_ixs(self, ixs: TT, lengths: TT) \
+            -> rnn.PackedSequence:
+        """Embed the given batch of sentences, represented by a padded
+        tensor of word indices of shape [B, N] and the lengths of the
+        individual sentences, as a packed sequence.
+        """
+        packed_ixs = rnn.pack_padded_sequence(
+            ixs, lengths, batch_first=True, enforce_sorted=False)
+        embs = self.forwards_ixs(packed_ixs.data)
+        return replace_data(packed_ixs, embs)
+
+    @abstractmethod
+    def encode(self, word: Word) -> int:
+        """Return the index of the given word.
+
+        The index can be used to embed the word with `forwards_ixs`.
+        """
+        pass
+
+    @abstractmethod
+    def forwards_ixs(self, ixs: TT) -> TT:
+        """Embed the words given by their indices (see `encode`)."""
+        pass
+
     @abstractmethod
     def embedding_size(self) -> int:
         """Return the size of the embedding vectors."""
         pass
 
+    @abstractmethod
+    def embedding_matrix(self) -> TT:
+        """Return the matrix whose rows are the embedding vectors of the
+        words, by their indices (see `encode`).
+
+        Embedding with the matrix is equivalent to `forwards_ixs` in the
+        evaluation mode (i.e., without dropout, if any).
+        """
+        pass
+
+    @abstractmethod
+    def config(self) -> dict:
+        """Return the configuration (e.g., the vocabulary and the embedding
+        size) needed to re-create the embedder with `from_config`.
+        """
+        pass
+
+    @classmethod
+    @abstractmethod
+    def from_config(cls, config: dict) -> 'WordEmbedder':
+        """Create the embedder from the given configuration (see `config`).
+
+        The parameters and buffers are not part of the configuration; they
+        should be restored with `load_state_dict`.
+        """
+        pass
+
 
 # DONE: Implement this as a part of Ex.~2.  HINT: use the
 # Embedding class implemented in neural/embedding.py.
@@ -65,6 +143,23 @@ class AtomicEmbedder(WordEmbedder):
 
     For out-of-vocabulary words, the embedder should return 0:
     >>> assert (emb("dog") == 0).all()
+
+    Words can be also embedded based on their indices:
+    >>> ixs = torch.LongTensor([emb.encode("Cat"), emb.encode("dog")])
+    >>> assert (emb.forwards_ixs(ixs) == emb.forwards(["cat", "dog"])).all()
+
+    Finally, an entire batch of sentences can be embedded at once as a
+    packed sequence:
+    >>> packed = emb.forwards_batch([["cat"], ["cats", "dog"]])
+    >>> packed.data.shape
+    torch.Size([3, 10])
+
+    The embedder can be re-created from its configuration; the indices of
+    the words do not depend on the order of the input vocabulary:
+    >>> emb2 = AtomicEmbedder.from_config(emb.config())
+    >>> emb2.load_state_dict(emb.state_dict())
+    <All keys matched successfully>
+    >>> assert (emb2("cat") == emb("cat")).all()
     """
 
     def __init__(self, vocab: Set[Word], emb_size: int,
@@ -80,10 +175,11 @@ class AtomicEmbedder(WordEmbedder):
         super(AtomicEmbedder, self).__init__()
         # Keep info about the case sensitivity
         self.case_insensitive = case_insensitive
-        # Calculate the modified vocabulary
-        vocab = set(self.preprocess(x) for x in vocab)
+        # Calculate the modified vocabulary; it is sorted so that the
+        # indices of the words do not depend on the order of `vocab`
+        words = sorted(set(self.preprocess(x) for x in vocab))
         # Initialize the generic embedding module
-        self.emb = Embedding(vocab, emb_size)
+        self.emb = Embedding(words, emb_size)
 
     def preprocess(self, word: Word) -> Word:
         """Preprocessing function"""
@@ -104,22 +200,109 @@ class AtomicEmbedder(WordEmbedder):
         # performant `self.emb.fowards` method.
         return self.emb.forwards(map(self.preprocess, words))
 
+    def encode(self, word: Word) -> int:
+        """Return the index of the given word."""
+        return self.emb.encode(self.preprocess(word))
+
+    def forwards_ixs(self, ixs: TT) -> TT:
+        """Embed the words given by their indices."""
+        return self.emb.forwards_ixs(ixs)
+
     def embedding_size(self) -> int:
         """Return the embedding size of the word embedder."""
         return self.emb.embedding_size()
 
+    def embedding_matrix(self) -> TT:
+        return self.emb.emb.weight
+
+    def config(self) -> dict:
+        return {
+            'vocab': list(self.emb.obj_to_ix),
+            'emb_size': self.embedding_size(),
+            'case_insensitive': self.case_insensitive,
+        }
+
+    @classmethod
+    def from_config(cls, config: dict) -> 'AtomicEmbedder':
+        return cls(
+            config['vocab'], config['emb_size'],
+            case_insensitive=config['case_insensitive'])
+
 
 # TODO EX7: complete the implementation of this class
 class FastText(WordEmbedder):
-    """Module for fastText word embedding."""
+    """Module for fastText word embedding.
+
+    Parsing the textual .vec file is slow.  Therefore, by default, the
+    loaded vectors are cached in a binary format next to the .vec file:
+    * `<file_path>.<limit>.f32`: the embedding matrix (raw float32 values,
+      with an additional, zero row for out-of-vocabulary words)
+    * `<file_path>.<limit>.vocab`: the header (the number of words and
+      the embedding size) followed by the words, one per line
+    In subsequent runs, the matrix is memory-mapped, which makes loading
+    almost instantaneous and allows processes to share the memory pages.
+    """
 
     def __init__(self, file_path, limit: int = 10 ** 6,
-                 dropout: float = 0.0):
+                 dropout: float = 0.0, cache=True):
         super(FastText, self).__init__()
         # Create dropout object
         self.dropout = nn.Dropout(p=dropout, inplace=False)
         # Load vectors
-        self._load_vectors(file_path, limit)
+        if cache:
+            self._load_cached(file_path, limit)
+        else:
+            self._load_vectors(file_path, limit)
+
+    def _load_cached(self, fname, limit):
+        matrix_path = "{}.{}.f32".format(fname, limit)
+        vocab_path = "{}.{}.vocab".format(fname, limit)
+        # (Re-)create the cache if it is missing or older than the source
+        if not (os.path.exists(matrix_path) and os.path.exists(vocab_path)
+                and os.path.getmtime(vocab_path) >= os.path.getmtime(fname)):
+            self._create_cache(fname, limit, matrix_path, vocab_path)
+        # Read the vocabulary
+        with io.open(vocab_path, 'r', encoding='utf-8', newline='\n') as f:
+            num, dim = map(int, f.readline().split())
+            words = f.read().split('\n')[:num]
+        assert len(words) == num
+        # Store the embedding size
+        self.emb_size = dim
+        # Map words to the corresponding rows of the embedding matrix
+        self.word_to_ix = {word: ix for ix, word in enumerate(words)}
+        # The last row of the embedding matrix, fixed to 0, is used to
+        # represent out-of-vocabulary words
+        self.padding_idx = num
+        # Memory-map the embedding matrix; `shared=False` means that the
+        # modifications of the tensor (if any) are not written to the file
+        vectors = torch.from_file(
+            matrix_path, shared=False, size=(num+1)*dim, dtype=torch.float)
+        self.register_buffer('vectors', vectors.view(num+1, dim))
+
+    @staticmethod
+    def _create_cache(fname, limit, matrix_path, vocab_path):
+        fast_file = io.open(fname, 'r', encoding='utf-8',
+                            newline='\n', errors='ignore')
+        _num, dim = map(int, fast_file.readline().split())
+        words = []
+        # The vocabulary file is written last, since its modification
+        # time is used to determine if the cache is up to date
+        with atomic_write(matrix_path) as matrix_file:
+            for line in fast_file:
+                tokens = line.rstrip().split(' ')
+                emb = array('f', map(float, tokens[1:]))
+                assert len(emb) == dim
+                emb.tofile(matrix_file)
+                words.append(tokens[0])
+                if len(words) >= limit:
+                    break
+            # Zero vector for out-of-vocabulary words
+            array('f', [0.0] * dim).tofile(matrix_file)
+        fast_file.close()
+        with atomic_write(vocab_path, 'w', encoding='utf-8',
+                          newline='\n') as vocab_file:
+            vocab_file.write("{} {}\n".format(len(words), dim))
+            vocab_file.write('\n'.join(words))
 
     def _load_vectors(self, fname, limit):
         # Code adapted from:
@@ -129,9 +312,9 @@ class FastText(WordEmbedder):
         _num, dim = map(int, fast_file.readline().split())
         # Store the embedding size
         self.emb_size = dim
-        # Use .data dictionary to store the embeddings
-        self.data = {}
-        k = 0
+        # Map words to the corresponding rows of the embedding matrix
+        self.word_to_ix = {}  # type: Dict[Word, int]
+        vectors = []
         # Each subsequent line contains the word and the corresponding
         # embedding vector
         for line in fast_file:
@@ -139,31 +322,77 @@ class FastText(WordEmbedder):
             word = tokens[0]
             emb = list(map(float, tokens[1:]))
             assert len(emb) == dim
-            self.data[word] = torch.tensor(emb, dtype=torch.float)
+            self.word_to_ix[word] = len(vectors)
+            vectors.append(emb)
             # We only want to load a certain amout of most-frequent
             # embedding vectors, hence `break` below
-            k += 1
-            if k >= limit:
+            if len(vectors) >= limit:
                 break
+        # The last row of the embedding matrix, fixed to 0, is used to
+        # represent out-of-vocabulary words
+        self.padding_idx = len(vectors)
+        vectors.append([0.0] * dim)
+        # Store the embeddings in a single matrix; we register it as a
+        # buffer, since fastText embeddings are not fine-tuned
+        self.register_buffer(
+            'vectors', torch.tensor(vectors, dtype=torch.float))
 
     def forward(self, word: Word) -> TT:
         """Embed the given word."""
-        # TODO EX7: implement this function
-        # TODO UPDATE 13.01.2020: is using torch.no_grad() here
-        # really necessary?
-
-        # with torch.no_grad():
-        #     try:
-        #         return self.data[word]
-        #     except KeyError:
-        #         return torch.zeros(self.embedding_size())
-
-        try:
-            emb = self.data[word]
-            emb = self.dropout(emb)
-            return emb
-        except KeyError:
-            return torch.zeros(self.emb_size)
+        return self.forwards_ixs(torch.tensor(self.encode(word)))
+
+    def forwards(self, words: Iterable[Word]) -> TT:
+        """Embed the given sequence of words."""
+        # Similarly as in `AtomicEmbedder`, this is faster than the default
+        # implementation: the embedding vectors are retrieved in one go,
+        # and dropout is applied once to the resulting matrix
+        ixs = torch.LongTensor([self.encode(word) for word in words])
+        return self.forwards_ixs(ixs)
+
+    def encode(self, word: Word) -> int:
+        """Return the index of the given word."""
+        return self.word_to_ix.get(word, self.padding_idx)
+
+    def forwards_ixs(self, ixs: TT) -> TT:
+        """Embed the words given by their indices."""
+        # Out-of-vocabulary words are mapped to the zero row of the
+        # embedding matrix, hence no need to create zero vectors
+        return self.dropout(self.vectors[ixs])
 
     def embedding_size(self):
         return self.emb_size
+
+    def embedding_matrix(self) -> TT:
+        return self.vectors
+
+    def config(self) -> dict:
+        return {
+            'word_to_ix': self.word_to_ix,
+            'padding_idx': self.padding_idx,
+            'emb_size': self.emb_size,
+            'dropout': self.dropout.p,
+        }
+
+    @classmethod
+    def from_config(cls, config: dict) -> 'FastText':
+        """Create the embedder without reading the .vec file.
+
+        The embedding matrix is initialized with zeros and should be
+        restored with `load_state_dict`.
+        """
+        emb = cls.__new__(cls)
+        super(FastText, emb).__init__()
+        emb.dropout = nn.Dropout(p=config['dropout'], inplace=False)
+        emb.emb_size = config['emb_size']
+        emb.word_to_ix = dict(config['word_to_ix'])
+        emb.padding_idx = config['padding_idx']
+        emb.register_buffer(
+            'vectors', torch.zeros(emb.padding_idx+1, emb.emb_size))
+        return emb
+
+
+# Word embedder classes, by name (see `WordEmbedder.from_config`)
+EMBEDDERS = {    # type: Dict[str, Type[WordEmbedder]]
+    'AtomicEmbedder': AtomicEmbedder,
+    'FastText': FastText,
+}